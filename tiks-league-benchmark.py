@@ -0,0 +1,491 @@
+#!/usr/bin/env python3
+"""Generate synthetic Ulti-Analytics data, and benchmark tiks-league-scoring.py
+
+The generated games are written as pairs of CSV files (one per team), named
+`<team1>-<team2>-<game-id>.csv`, in the same column layout as the exports from
+Ulti-Analytics. The players are picked from the roster in the `gender` module.
+
+Usage:
+
+    ./tiks-league-benchmark.py generate /path/to/dir --games 100
+    ./tiks-league-benchmark.py run --games 10 100 1000 --engine arrays
+    ./tiks-league-benchmark.py check --games 100
+    ./tiks-league-benchmark.py fetch --games 50 --latency 0.2 --flaky
+
+"""
+
+from argparse import ArgumentParser
+import csv
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+import os
+from os.path import isfile, join
+import random
+import sys
+import tempfile
+import threading
+import time
+from types import ModuleType
+from typing import Any, Dict, List, Set, Tuple  # noqa
+
+import pandas as pd
+
+from gender import FEMALE, ALL
+from tiks_league_loader import load_scoring
+
+TEAMS = ["Idli", "Vada", "Dosa", "Upma"]
+COLUMNS = (
+    [
+        "Date/Time",
+        "Tournamemnt",
+        "Opponent",
+        "Point Elapsed Seconds",
+        "Line",
+        "Our Score - End of Point",
+        "Their Score - End of Point",
+        "Event Type",
+        "Action",
+        "Passer",
+        "Receiver",
+        "Defender",
+        "Hang Time (secs)",
+    ]
+    + ["Player {}".format(i) for i in range(28)]
+    + [
+        "Elapsed Time (secs)",
+        "Begin Area",
+        "Begin X",
+        "Begin Y",
+        "End Area",
+        "End X",
+        "End Y",
+        "Distance Unit of Measure",
+    ]
+)
+GAME_TO = 11
+STAGES = [
+    "load",
+    "segmentation",
+    "on-field",
+    "passes by gender",
+    "expected passes",
+    "pullers",
+    "longest O",
+    "fastest D",
+]
+
+# Events of a team: (Event Type, Action, Passer, Receiver, Defender)
+Event = Tuple[str, str, str, str, str]
+
+
+# Data generation ######################################################
+
+
+def make_rosters(
+    teams: List[str], rng: random.Random
+) -> Dict[str, Tuple[List[str], List[str]]]:
+    """Split the players into teams of women and men."""
+    women = sorted(FEMALE & ALL)
+    men = sorted(ALL - FEMALE)
+    assert len(women) >= 4 and len(men) >= 4, "Need at least 4 women and men"
+    rng.shuffle(women)
+    rng.shuffle(men)
+    n = len(teams)
+    rosters = {}
+    for i, team in enumerate(teams):
+        team_women = women[i::n]
+        team_men = men[i::n]
+        # Small rosters share players between teams
+        if len(team_women) < 4:
+            team_women = rng.sample(women, 4)
+        if len(team_men) < 4:
+            team_men = rng.sample(men, 4)
+        rosters[team] = (team_women, team_men)
+    return rosters
+
+
+def pick_line(
+    roster: Tuple[List[str], List[str]], rng: random.Random
+) -> List[str]:
+    """Pick 7 players for a point, with 3 or 4 women."""
+    women, men = roster
+    num_women = rng.choice([3, 4])
+    return rng.sample(women, num_women) + rng.sample(men, 7 - num_women)
+
+
+def play_possession(
+    offense: List[str], defense: List[str], rng: random.Random
+) -> Tuple[List[Event], List[Event], bool]:
+    """Play a possession, till a score or a turnover.
+
+    Returns the events recorded by the offense and the defense, and whether
+    the offense scored.
+
+    """
+    offense_events = []  # type: List[Event]
+    defense_events = []  # type: List[Event]
+    holder = rng.choice(offense)
+    for passes in range(rng.randint(0, 12)):
+        receiver = rng.choice([p for p in offense if p != holder])
+        r = rng.random()
+        if r < 0.06 and passes >= 2:
+            offense_events.append(("Offense", "Throwaway", holder, "", ""))
+            defender = rng.choice(defense)
+            defense_events.append(("Defense", "D", "", "", defender))
+            return offense_events, defense_events, False
+        elif r < 0.10:
+            offense_events.append(("Offense", "Throwaway", holder, "", ""))
+            defense_events.append(("Defense", "Throwaway", "", "", ""))
+            return offense_events, defense_events, False
+        elif r < 0.13:
+            offense_events.append(("Offense", "Drop", holder, receiver, ""))
+            defense_events.append(("Defense", "Throwaway", "", "", ""))
+            return offense_events, defense_events, False
+        offense_events.append(("Offense", "Catch", holder, receiver, ""))
+        holder = receiver
+
+    receiver = rng.choice([p for p in offense if p != holder])
+    offense_events.append(("Offense", "Goal", holder, receiver, ""))
+    defense_events.append(("Defense", "Goal", "", "", ""))
+    return offense_events, defense_events, True
+
+
+def generate_game(
+    teams: Tuple[str, str],
+    rosters: Dict[str, Tuple[List[str], List[str]]],
+    rng: random.Random,
+) -> Dict[str, List[Dict[str, Any]]]:
+    """Generate the rows recorded by each team for a game."""
+    rows = {team: [] for team in teams}  # type: Dict[str, List[Dict]]
+    score = {team: 0 for team in teams}
+    pulling = teams[0]
+    halftime = False
+    while max(score.values()) < GAME_TO:
+        lines = {team: pick_line(rosters[team], rng) for team in teams}
+        events = {team: [] for team in teams}  # type: Dict[str, List[Event]]
+        receiving = teams[1] if pulling == teams[0] else teams[0]
+        pull = rng.choice(["Pull", "Pull", "PullOb"])
+        puller = rng.choice(lines[pulling])
+        events[pulling].append(("Defense", pull, "", "", puller))
+
+        offense, defense = receiving, pulling
+        while True:
+            o_events, d_events, scored = play_possession(
+                lines[offense], lines[defense], rng
+            )
+            events[offense].extend(o_events)
+            events[defense].extend(d_events)
+            if scored:
+                break
+            offense, defense = defense, offense
+
+        score[offense] += 1
+        if not halftime and score[offense] == (GAME_TO + 1) // 2:
+            halftime = True
+            for team in teams:
+                events[team].append(("Cessation", "Halftime", "", "", ""))
+
+        for team in teams:
+            opponent = teams[1] if team == teams[0] else teams[0]
+            for event_type, action, passer, receiver, defender in events[team]:
+                row = dict.fromkeys(COLUMNS, "")
+                row.update(
+                    {
+                        "Tournamemnt": "TIKS League",
+                        "Opponent": opponent,
+                        "Line": "D" if team == pulling else "O",
+                        "Our Score - End of Point": score[team],
+                        "Their Score - End of Point": score[opponent],
+                        "Event Type": event_type,
+                        "Action": action,
+                        "Passer": passer,
+                        "Receiver": receiver,
+                        "Defender": defender,
+                        "Elapsed Time (secs)": rng.randint(0, 6000),
+                    }
+                )
+                for i, player in enumerate(lines[team]):
+                    row["Player {}".format(i)] = player
+                rows[team].append(row)
+
+        pulling = offense
+    return rows
+
+
+def generate_games(
+    data_dir: str, num_games: int, seed: int = 0, teams: List[str] = TEAMS
+) -> None:
+    """Write CSV file pairs for `num_games` random games to `data_dir`."""
+    rng = random.Random(seed)
+    rosters = make_rosters(teams, rng)
+    for game_id in range(num_games):
+        team_1, team_2 = rng.sample(teams, 2)
+        rows = generate_game((team_1, team_2), rosters, rng)
+        for team, opponent in ((team_1, team_2), (team_2, team_1)):
+            name = "{}-{}-{}.csv".format(team, opponent, game_id)
+            with open(join(data_dir, name), "w", newline="") as f:
+                writer = csv.DictWriter(f, COLUMNS)
+                writer.writeheader()
+                writer.writerows(rows[team])
+
+
+# Benchmarks ###########################################################
+
+
+def benchmark(
+    data_dir: str, scoring: ModuleType, engine: str = "pandas"
+) -> Dict[str, float]:
+    """Time each stage of scoring, for all the games in `data_dir`."""
+    timings = dict.fromkeys(STAGES, 0.0)
+
+    def timed(stage, f, *args):
+        start = time.perf_counter()
+        result = f(*args)
+        timings[stage] += time.perf_counter() - start
+        return result
+
+    for game_id, urls in scoring.find_match_data(data_dir):
+        data = [timed("load", scoring.parse_game_csv, url) for url in urls]
+        names = [d["Opponent"].iloc[0] for d in reversed(data)]
+        game = [
+            (name, timed("segmentation", scoring.segment_points, d, engine))
+            for name, d in zip(names, data)
+        ]
+        for _, points in game:
+            timed("on-field", scoring.on_field_score_team, points, engine)
+            timed("passes by gender", scoring.passes_by_gender, points.data)
+            timed("expected passes", scoring.expected_passes_count, points)
+            timed("pullers", scoring.pullers, points.data)
+            timed(
+                "longest O", scoring.longest_no_turn_score, points, engine
+            )
+        timed("fastest D", scoring.fastest_d, game)
+
+    return timings
+
+
+# Engine checks ########################################################
+
+# Per-point scorers of the pandas engine, and their array engine equivalents
+POINT_CHECKS = [
+    ("is_all_touch", True, "store_is_all_touch"),
+    ("is_perfect_score", True, "store_is_perfect_score"),
+    ("has_no_turnovers", False, "store_has_no_turnovers"),
+    ("no_turn_score_pass_count", False, "store_no_turn_score_pass_count"),
+]
+# Stages that are scored by either engine
+ENGINE_STAGES = ["on_field_bonuses", "longest_no_turn_score"]
+
+
+def check_engines(data_dir: str, scoring: ModuleType) -> List[str]:
+    """Check that the pandas and arrays engines agree on all the games.
+
+    Returns a description of each disagreement.
+
+    """
+    errors = []
+    for game_id, urls in scoring.find_match_data(data_dir):
+        for team, points in scoring.read_game_data(urls).items():
+            store = scoring.event_store(points)
+            where = "{} {}".format(game_id, team)
+            for i, (_, point) in enumerate(scoring.iter_points(points)):
+                for name, uses_roster, store_name in POINT_CHECKS:
+                    args = (point, points.roster) if uses_roster else (point,)
+                    expected = getattr(scoring, name)(*args)
+                    actual = getattr(scoring, store_name)(store, i)
+                    if expected != actual:
+                        errors.append(
+                            "{} point {}: {} is {}, {} is {}".format(
+                                where, i, name, expected, store_name, actual
+                            )
+                        )
+
+            for name in ENGINE_STAGES:
+                stage = getattr(scoring, name)
+                expected = stage(points, "pandas")
+                actual = stage(points, "arrays")
+                if isinstance(expected, pd.DataFrame):
+                    same = expected.equals(actual)
+                else:
+                    same = expected == actual
+                if not same:
+                    errors.append(
+                        "{}: {} is {} with pandas, {} with arrays".format(
+                            where, name, expected, actual
+                        )
+                    )
+    return errors
+
+
+def check(num_games: int, seed: int = 0) -> None:
+    scoring = load_scoring()
+    with tempfile.TemporaryDirectory() as data_dir:
+        generate_games(data_dir, num_games, seed)
+        errors = check_engines(data_dir, scoring)
+    for error in errors:
+        print(error)
+    print("{} games checked, {} disagreements".format(num_games, len(errors)))
+    if errors:
+        sys.exit(1)
+
+
+# Fetch benchmark ######################################################
+
+
+class RemoteHandler(SimpleHTTPRequestHandler):
+    """Serve files like a slow, flaky remote server, with ETags.
+
+    Each response is delayed by `latency` seconds, and if `flaky` is set, the
+    first request for each file fails with a 503.
+
+    """
+
+    latency = 0.0
+    flaky = False
+    failed = set()  # type: Set[str]
+    lock = threading.Lock()
+
+    def etag(self) -> str:
+        stat = os.stat(self.translate_path(self.path))
+        return '"{}-{}"'.format(stat.st_size, stat.st_mtime_ns)
+
+    def do_GET(self) -> None:
+        time.sleep(self.latency)
+        with self.lock:
+            fail = self.flaky and self.path not in self.failed
+            self.failed.add(self.path)
+        if fail:
+            self.send_error(503)
+        elif isfile(self.translate_path(self.path)) and self.headers.get(
+            "If-None-Match"
+        ) == self.etag():
+            self.send_response(304)
+            self.end_headers()
+        else:
+            super().do_GET()
+
+    def end_headers(self) -> None:
+        if isfile(self.translate_path(self.path)):
+            self.send_header("ETag", self.etag())
+        super().end_headers()
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+class RemoteServer(ThreadingHTTPServer):
+    # The default backlog of 5 connections drops concurrent connections, and
+    # the clients only retry them after a second
+    request_queue_size = 128
+
+
+def fetch(
+    num_games: int, seed: int = 0, latency: float = 0.1, flaky: bool = False
+) -> None:
+    """Time fetching games from a local stand-in for a remote server.
+
+    The games are fetched twice; the second time, all the files are unchanged.
+
+    """
+    scoring = load_scoring()
+    handler = type(
+        "Handler",
+        (RemoteHandler,),
+        {"latency": latency, "flaky": flaky, "failed": set()},
+    )
+    with tempfile.TemporaryDirectory() as served, tempfile.TemporaryDirectory(
+    ) as data_dir:
+        generate_games(served, num_games, seed)
+        server = RemoteServer(
+            ("127.0.0.1", 0), partial(handler, directory=served)
+        )
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        urls = [
+            "http://127.0.0.1:{}/{}".format(server.server_port, name)
+            for name in sorted(os.listdir(served))
+        ]
+        for run in ("First", "Second"):
+            start = time.perf_counter()
+            fetched = scoring.fetch_matches(urls, data_dir)
+            seconds = time.perf_counter() - start
+            print("{} fetch:".format(run))
+            scoring.print_fetch_stats(fetched, seconds)
+        server.shutdown()
+
+        for name in os.listdir(served):
+            with open(join(served, name), "rb") as f, open(
+                join(data_dir, name), "rb"
+            ) as g:
+                assert f.read() == g.read(), "{} differs".format(name)
+
+
+def main(sizes: List[int], seed: int = 0, engine: str = "pandas") -> None:
+    scoring = load_scoring()
+    results = {}
+    for num_games in sizes:
+        with tempfile.TemporaryDirectory() as data_dir:
+            generate_games(data_dir, num_games, seed)
+            results[num_games] = benchmark(data_dir, scoring, engine)
+        print("Benchmarked {} games".format(num_games))
+
+    timings = pd.DataFrame(results)
+    timings.columns.name = "Games"
+    timings.loc["total"] = timings.sum()
+    print("Time taken (seconds):")
+    print(timings.round(3).to_string())
+    print("Time taken per game (milliseconds):")
+    print((timings / timings.columns * 1000).round(2).to_string())
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(prog=__file__, usage=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    generate_parser = subparsers.add_parser(
+        "generate", help="Generate synthetic game data"
+    )
+    generate_parser.add_argument("data_dir", help="Directory to write to")
+    generate_parser.add_argument("--games", type=int, default=10)
+    generate_parser.add_argument("--seed", type=int, default=0)
+
+    run_parser = subparsers.add_parser(
+        "run", help="Time the scoring stages on synthetic data"
+    )
+    run_parser.add_argument(
+        "--games", type=int, nargs="+", default=[10, 100, 1000]
+    )
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument(
+        "--engine", choices=["pandas", "arrays"], default="pandas"
+    )
+
+    check_parser = subparsers.add_parser(
+        "check", help="Check that the scoring engines agree"
+    )
+    check_parser.add_argument("--games", type=int, default=100)
+    check_parser.add_argument("--seed", type=int, default=0)
+
+    fetch_parser = subparsers.add_parser(
+        "fetch", help="Time fetching games from a local HTTP server"
+    )
+    fetch_parser.add_argument("--games", type=int, default=50)
+    fetch_parser.add_argument("--seed", type=int, default=0)
+    fetch_parser.add_argument(
+        "--latency", type=float, default=0.1, help="Delay of each response"
+    )
+    fetch_parser.add_argument(
+        "--flaky",
+        action="store_true",
+        help="Fail the first request for each file",
+    )
+
+    args = parser.parse_args()
+    if args.command == "generate":
+        generate_games(args.data_dir, args.games, args.seed)
+    elif args.command == "check":
+        check(args.games, args.seed)
+    elif args.command == "fetch":
+        fetch(args.games, args.seed, args.latency, args.flaky)
+    else:
+        main(args.games, args.seed, args.engine)
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""Query the events of the TIKS league games, for ad-hoc analytics.
+
+The games are loaded using tiks-league-scoring.py, and the events are indexed
+by player (as passer, receiver or defender), by action, by point and by game.
+Queries intersect these indexes, instead of scanning all the events, and
+return DataFrames.
+
+Usage:
+
+    ./tiks-league-query.py /path/to/dir --passer A --receiver B
+    ./tiks-league-query.py /path/to/dir --defender X --action Pull --points
+
+From Python:
+
+    index = load_index("/path/to/dir")
+    pulls = index.select(defender="X", action=PULLS)
+    index.points_of(pulls).query("Broke")
+
+"""
+
+from argparse import ArgumentParser
+from types import ModuleType
+from typing import Dict, Iterable, Optional, Tuple, Union  # noqa
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame as DF
+
+from tiks_league_loader import load_scoring
+
+ROLES = ["Passer", "Receiver", "Defender"]
+POINT_KEYS = ["Game", "Team", "Point"]
+PASSES = ("Catch", "Goal", "Drop")
+PULLS = ("Pull", "PullOb")
+EMPTY = np.array([], dtype=np.intp)
+
+
+def point_table(events: DF) -> DF:
+    """Summarize each point of each team in the games.
+
+    Returns the number of events and passes, the puller, whether the team
+    pulled (D line), scored, and broke (scored after pulling), indexed by the
+    game, team and point.
+
+    """
+    actions = events["Action"].astype(str)
+    pull = actions.isin(PULLS).values
+    # The opponent's goals are recorded by the defending team, with no passer
+    has_passer = events["Passer"].notna().values
+    goal = (actions == "Goal").values & has_passer
+    summary = (
+        events[POINT_KEYS]
+        .assign(
+            Events=1,
+            Passes=actions.isin(PASSES).values & has_passer,
+            Pulled=pull,
+            Scored=goal,
+            Puller=events["Defender"].where(pull),
+        )
+        .groupby(POINT_KEYS, sort=False)
+        .agg(
+            {
+                "Events": "sum",
+                "Passes": "sum",
+                "Pulled": "any",
+                "Scored": "any",
+                "Puller": "first",
+            }
+        )
+    )
+    summary["Line"] = np.where(summary["Pulled"], "D", "O")
+    summary["Broke"] = summary["Pulled"] & summary["Scored"]
+    return summary.drop(columns="Pulled")
+
+
+class EventIndex:
+    """The events of many games, indexed for queries.
+
+    The indexes map each key to the positions of its events, and are built
+    with a single group by per index.
+
+    """
+
+    def __init__(self, events: DF, players: DF) -> None:
+        self.events = events.reset_index(drop=True)
+        self.players = players.reset_index(drop=True)
+        self.by_role = {
+            role: self.group_positions(self.events[role]) for role in ROLES
+        }
+        self.by_action = self.group_positions(self.events["Action"])
+        self.by_game = self.group_positions(self.events["Game"])
+        self.by_team = self.group_positions(self.events["Team"])
+        self.by_point = self.events.groupby(POINT_KEYS, sort=False).indices
+        self.points = point_table(self.events)
+        self.points_by_player = self.group_positions(self.players["Player"])
+
+    @staticmethod
+    def group_positions(values: pd.Series) -> Dict[str, np.ndarray]:
+        """Map each (non-missing) value to the positions where it occurs."""
+        return values.groupby(values.values).indices
+
+    @staticmethod
+    def lookup(
+        index: Dict[str, np.ndarray], keys: Union[str, Iterable[str]]
+    ) -> np.ndarray:
+        """Positions of any of the keys in an index."""
+        if isinstance(keys, str):
+            return index.get(keys, EMPTY)
+        positions = [index.get(key, EMPTY) for key in keys]
+        return np.unique(np.concatenate(positions)) if positions else EMPTY
+
+    def select(
+        self,
+        player: Optional[str] = None,
+        passer: Optional[str] = None,
+        receiver: Optional[str] = None,
+        defender: Optional[str] = None,
+        action: Union[None, str, Iterable[str]] = None,
+        game: Optional[str] = None,
+        team: Optional[str] = None,
+    ) -> DF:
+        """Select the events that match all the given filters.
+
+        `player` matches a player in any role, and `action` can be a tuple of
+        actions. For example, every pass from A to B is
+        `select(passer="A", receiver="B", action=PASSES)`.
+
+        """
+        filters = [
+            (self.by_role["Passer"], passer),
+            (self.by_role["Receiver"], receiver),
+            (self.by_role["Defender"], defender),
+            (self.by_action, action),
+            (self.by_game, game),
+            (self.by_team, team),
+        ]
+        selected = []
+        if player is not None:
+            roles = [self.lookup(self.by_role[role], player) for role in ROLES]
+            selected.append(np.unique(np.concatenate(roles)))
+        selected.extend(
+            self.lookup(index, keys)
+            for index, keys in filters
+            if keys is not None
+        )
+        if not selected:
+            return self.events
+        # Intersect the smallest sets first
+        selected.sort(key=len)
+        positions = selected[0]
+        for other in selected[1:]:
+            positions = np.intersect1d(positions, other, assume_unique=True)
+        return self.events.iloc[positions]
+
+    def point(self, game: str, team: str, point: int) -> DF:
+        """Return the events of a point of a team."""
+        positions = self.by_point.get((game, team, point), EMPTY)
+        return self.events.iloc[positions]
+
+    def points_of(self, events: DF) -> DF:
+        """Return the points (see `point_table`) that the events are in."""
+        keys = pd.MultiIndex.from_frame(events[POINT_KEYS]).unique()
+        return self.points.loc[keys]
+
+    def points_played(self, player: str) -> DF:
+        """Return the points that a player played."""
+        positions = self.points_by_player.get(player, EMPTY)
+        players = self.players.iloc[positions]
+        return self.points.loc[pd.MultiIndex.from_frame(players[POINT_KEYS])]
+
+
+def load_index(
+    data_dir: str,
+    use_cache: bool = True,
+    scoring: Optional[ModuleType] = None,
+) -> EventIndex:
+    """Load all the games in the data directory, and index their events."""
+    scoring = scoring or load_scoring()
+    matches = scoring.find_match_data(data_dir, use_cache=use_cache)
+    events, players = scoring.game_events(
+        scoring.load_games(matches, use_cache)
+    )
+    return EventIndex(events, players)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(prog=__file__, usage=__doc__.splitlines()[0])
+    parser.add_argument("data_dir", help="Directory with .csv data")
+    parser.add_argument("--player", help="Player in any role")
+    for role in ROLES:
+        parser.add_argument("--{}".format(role.lower()))
+    parser.add_argument("--action", nargs="+")
+    parser.add_argument("--game")
+    parser.add_argument("--team")
+    parser.add_argument(
+        "--points",
+        action="store_true",
+        help="Show the points of the selected events, instead of the events",
+    )
+    args = parser.parse_args()
+
+    index = load_index(args.data_dir)
+    result = index.select(
+        args.player,
+        args.passer,
+        args.receiver,
+        args.defender,
+        args.action,
+        args.game,
+        args.team,
+    )
+    if args.points:
+        result = index.points_of(result)
+    print(result.to_string())
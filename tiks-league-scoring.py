@@ -24,9 +24,21 @@ On field scoring(Counts towards goal tally, per game)
 
 from argparse import ArgumentParser
 from collections import Counter, defaultdict
-import glob
-from os.path import basename, join, splitext
+from concurrent.futures import ThreadPoolExecutor
+import cProfile
+import csv
+from functools import partial, wraps
+import hashlib
+import json
+from multiprocessing import Pool
+import os
+from os.path import abspath, basename, dirname, isfile, join, splitext
+import pickle
 from pprint import pprint
+import pstats
+import sys
+import threading
+import time
 from typing import (  # noqa
     Tuple,
     List,
@@ -35,115 +47,971 @@ from typing import (  # noqa
     Set,
     Counter as TCounter,
     Any,
+    NamedTuple,
+    Iterable,
+    Optional,
+    Callable,
 )
+from urllib.parse import unquote, urlparse
 
+import numpy as np
 import pandas as pd
 from pandas import DataFrame as DF, Series
 
 from gender import FEMALE, ALL
 
+SCORE_COLUMNS = ["Our Score - End of Point", "Their Score - End of Point"]
+# Columns of the Ulti-Analytics export used for scoring, and their types.
+# The "Player N" columns are also read, as categoricals. All other columns
+# (Elapsed Time, etc.) are ignored.
+GAME_SCHEMA = {
+    "Opponent": "category",
+    "Our Score - End of Point": "int16",
+    "Their Score - End of Point": "int16",
+    "Event Type": "category",
+    "Action": "category",
+    "Passer": "category",
+    "Receiver": "category",
+    "Defender": "category",
+}
+CACHE_DIR = ".tiks-cache"
+SCORES_FILE = "scores.pkl"
+GENDERS = {name: "F" if name in FEMALE else "M" for name in ALL}
+GENDER_PAIRS = ["F-F", "F-M", "M-F", "M-M"]
+CHANGE_EVENTS = ("Throwaway", "D", "Drop", "Goal")
+# Engines used by the per-point stages (on-field bonuses and longest O):
+# "pandas" scores all the points of a team at once, and "arrays" scores each
+# point as views of an `EventStore`.
+ENGINES = ("pandas", "arrays")
+
+# Events of a team stored as integer codes, with -1 for missing values.
+# `event_types`, `actions` and `players` are the names of the codes. The codes
+# of the Anonymous player and of Offense events (-1 if absent) are looked up
+# once. `start` and `end` are the offsets of the points, and `num_players` and
+# `women` the number of players and women in each point.
+EventStore = NamedTuple(
+    "EventStore",
+    [
+        ("event_type", np.ndarray),
+        ("action", np.ndarray),
+        ("passer", np.ndarray),
+        ("receiver", np.ndarray),
+        ("defender", np.ndarray),
+        ("scores", np.ndarray),
+        ("start", np.ndarray),
+        ("end", np.ndarray),
+        ("num_players", np.ndarray),
+        ("women", np.ndarray),
+        ("event_types", np.ndarray),
+        ("actions", np.ndarray),
+        ("players", np.ndarray),
+        ("anonymous", int),
+        ("offense", int),
+    ],
+)
+
+# Team data segmented into points. `start` and `end` are the (positional)
+# offsets of each point's events in `data`, `scores` the score at the end of
+# each point, and `roster` the players who played each point. `store` has the
+# same events as arrays, when the arrays engine is used.
+Points = NamedTuple(
+    "Points",
+    [
+        ("data", DF),
+        ("scores", List[Tuple[int, int]]),
+        ("start", np.ndarray),
+        ("end", np.ndarray),
+        ("roster", DF),
+        ("store", Optional[EventStore]),
+    ],
+)
+
+# Time taken to load a CSV file, whether it was loaded from the cache, and the
+# memory used by the loaded data (in bytes)
+LoadStats = NamedTuple(
+    "LoadStats",
+    [("path", str), ("cached", bool), ("seconds", float), ("memory", int)],
+)
+
+# Profiling ############################################################
+
+
+class StageProfiler:
+    """Record the wall time, calls and rows processed by each scoring stage.
+
+    Stages are marked with the `stage` decorator. Nothing is recorded unless
+    the profiler is enabled, and the stats are collected per match. A cProfile
+    of each stage can also be recorded.
+
+    """
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self.use_cprofile = False
+        self.reset()
+
+    def reset(self) -> None:
+        self.stats = {}  # type: Dict[str, Dict[str, float]]
+        self.cprofiles = {}  # type: Dict[str, cProfile.Profile]
+
+    def stage(self, name: str) -> Callable[[Callable], Callable]:
+        def decorator(f: Callable) -> Callable:
+            @wraps(f)
+            def wrapper(*args: Any, **kwargs: Any) -> Any:
+                if not self.enabled:
+                    return f(*args, **kwargs)
+                return self.run(name, f, *args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def run(self, name: str, f: Callable, *args: Any, **kwargs: Any) -> Any:
+        profile = None
+        if self.use_cprofile:
+            profile = self.cprofiles.setdefault(name, cProfile.Profile())
+            profile.enable()
+        start = time.perf_counter()
+        result = f(*args, **kwargs)
+        seconds = time.perf_counter() - start
+        if profile is not None:
+            profile.disable()
+
+        stats = self.stats.setdefault(
+            name, {"seconds": 0.0, "calls": 0, "rows": 0}
+        )
+        stats["seconds"] += seconds
+        stats["calls"] += 1
+        stats["rows"] += count_rows(args[0] if args else None) or count_rows(
+            result
+        )
+        return result
+
+    def collect(self) -> Dict[str, Any]:
+        """Return the stats recorded since the last collection."""
+        cprofiles = {}
+        for name, profile in self.cprofiles.items():
+            profile.create_stats()
+            cprofiles[name] = profile.stats  # type: ignore
+        collected = {"stages": self.stats, "cprofile": cprofiles}
+        self.reset()
+        return collected
+
+
+def count_rows(value: Any) -> int:
+    """Count the rows of team data in the arguments or results of a stage."""
+    if isinstance(value, Points):
+        return len(value.data)
+    elif isinstance(value, DF):
+        return len(value)
+    elif isinstance(value, (list, tuple)):
+        return sum(count_rows(item) for item in value)
+    return 0
+
+
+class SavedProfile:
+    """cProfile stats, in a form that `pstats.Stats` can load."""
+
+    def __init__(self, stats: Dict[Any, Any]) -> None:
+        self.stats = stats
+
+    def create_stats(self) -> None:
+        pass
+
+
+PROFILER = StageProfiler()
+
+# Files ################################################################
+
+
+def write_atomic(
+    path: str, write: Callable[[Any], None], binary: bool = False
+) -> None:
+    """Write a file with `write(f)`, through a temporary file that replaces
+    it once written, so that readers never see a partly written file.
+
+    The directory of the file is created if needed.
+
+    """
+    os.makedirs(dirname(path) or ".", exist_ok=True)
+    tmp_path = "{}.{}.{}".format(path, os.getpid(), threading.get_ident())
+    try:
+        with open(tmp_path, "wb" if binary else "w") as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if isfile(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+# Remote data ##########################################################
+
+REMOTE_FILE = "remote.json"
+# Maximum number of files fetched at once
+FETCH_JOBS = 64
+FETCH_RETRIES = 3
+FETCH_TIMEOUT = 30
+
+# Result of fetching a remote file: the local path it was saved to, the HTTP
+# status (304 if unchanged, None if it failed) and the time taken.
+FetchStats = NamedTuple(
+    "FetchStats",
+    [
+        ("url", str),
+        ("path", str),
+        ("status", Optional[int]),
+        ("seconds", float),
+    ],
+)
+
+
+def http_session(pool_size: int, retries: int = FETCH_RETRIES) -> Any:
+    """Create a requests session, with a connection pool and retries.
+
+    requests is only needed for fetching remote files, and is imported here.
+
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    retry = Retry(
+        total=retries,
+        backoff_factor=0.2,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["GET"],
+    )
+    adapter = HTTPAdapter(
+        pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry
+    )
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def url_filename(url: str) -> str:
+    """Return the name of the file in a URL."""
+    return basename(unquote(urlparse(url).path))
+
+
+def fetch_file(
+    session: Any, url: str, path: str, validators: Dict[str, str]
+) -> Tuple[FetchStats, Dict[str, str]]:
+    """Fetch a file, unless it hasn't changed since it was last fetched.
+
+    `validators` are the ETag and Last-Modified headers of the previous
+    response, and are sent as conditional request headers if the file exists.
+    Returns the stats, and the validators of the new response.
+
+    """
+    headers = {}
+    if isfile(path):
+        if "ETag" in validators:
+            headers["If-None-Match"] = validators["ETag"]
+        if "Last-Modified" in validators:
+            headers["If-Modified-Since"] = validators["Last-Modified"]
+
+    start = time.perf_counter()
+    try:
+        response = session.get(url, headers=headers, timeout=FETCH_TIMEOUT)
+        if response.status_code != 304:
+            response.raise_for_status()
+            write_atomic(path, lambda f: f.write(response.content), True)
+    except IOError as e:
+        print("Could not fetch {}: {}".format(url, e), file=sys.stderr)
+        seconds = time.perf_counter() - start
+        return FetchStats(url, path, None, seconds), validators
+
+    if response.status_code != 304:
+        validators = {
+            header: response.headers[header]
+            for header in ("ETag", "Last-Modified")
+            if header in response.headers
+        }
+    seconds = time.perf_counter() - start
+    return FetchStats(url, path, response.status_code, seconds), validators
+
+
+def fetch_matches(
+    urls: List[str], data_dir: str, jobs: Optional[int] = None
+) -> List[FetchStats]:
+    """Fetch the remote match files of a tournament into `data_dir`.
+
+    The files are fetched concurrently (all at once, up to `FETCH_JOBS` files,
+    by default), over a shared session. The ETag and
+    Last-Modified headers of each file are saved in the cache directory, and
+    files that haven't changed are not downloaded again (and are left
+    untouched, so that the parsed data and the scores are reused).
+
+    URLs without a file name, or with the same file name as another URL, are
+    not fetched, and are reported as failed.
+
+    """
+    state_path = join(data_dir, CACHE_DIR, REMOTE_FILE)
+    try:
+        with open(state_path) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        state = {}
+
+    urls = list(dict.fromkeys(urls))
+    names = Counter(url_filename(url) for url in urls)
+    skipped = []
+    for url in urls:
+        name = url_filename(url)
+        if name and names[name] == 1:
+            continue
+        reason = (
+            "the file name is also used by another URL"
+            if name
+            else "the URL has no file name"
+        )
+        print("Could not fetch {}: {}".format(url, reason), file=sys.stderr)
+        stats = FetchStats(url, join(data_dir, name), None, 0.0)
+        skipped.append((stats, state.get(url, {})))
+    skipped_urls = {stats.url for stats, _ in skipped}
+
+    jobs = jobs or max(min(len(urls), FETCH_JOBS), 1)
+    session = http_session(jobs)
+    with session, ThreadPoolExecutor(jobs) as executor:
+        futures = [
+            executor.submit(
+                fetch_file,
+                session,
+                url,
+                join(data_dir, url_filename(url)),
+                state.get(url, {}),
+            )
+            for url in urls
+            if url not in skipped_urls
+        ]
+        fetched = skipped + [future.result() for future in futures]
+
+    state.update((stats.url, validators) for stats, validators in fetched)
+    try:
+        write_atomic(state_path, lambda f: json.dump(state, f, indent=2))
+    except OSError as e:
+        print("Could not save the fetch state: {}".format(e), file=sys.stderr)
+    return [stats for stats, _ in fetched]
+
+
+def print_fetch_stats(fetched: List[FetchStats], seconds: float) -> None:
+    """Report the number of files fetched, and the time taken."""
+    failed = sum(s.status is None for s in fetched)
+    unchanged = sum(s.status == 304 for s in fetched)
+    slowest = max((s.seconds for s in fetched), default=0)
+    print(
+        "Fetched {} files in {:.3f}s: {} downloaded, {} unchanged, {} failed. "
+        "The slowest file took {:.3f}s".format(
+            len(fetched),
+            seconds,
+            len(fetched) - unchanged - failed,
+            unchanged,
+            failed,
+            slowest,
+        ),
+        file=sys.stderr,
+    )
+
+
+# Match discovery ######################################################
+
+MANIFEST_FILE = "manifest.json"
+
+# A CSV file of a match: the path relative to the data directory, its size
+# and modification time, and the opponent named in it (None if unreadable).
+MatchFile = NamedTuple(
+    "MatchFile",
+    [
+        ("path", str),
+        ("size", int),
+        ("mtime", int),
+        ("opponent", Optional[str]),
+    ],
+)
+
+# The matches in a data directory, keyed by the game id, and the files that
+# couldn't be paired. Orphans are the only file of their match (or files not
+# named like match files), and conflicts are more than two files with the
+# same game id, or two files naming the same opponent.
+Manifest = NamedTuple(
+    "Manifest",
+    [
+        ("matches", Dict[str, List[MatchFile]]),
+        ("orphans", List[MatchFile]),
+        ("conflicts", Dict[str, List[MatchFile]]),
+    ],
+)
+
+
+def scan_csv_files(
+    data_dir: str, prefix: str = ""
+) -> Generator[Tuple[str, os.DirEntry], None, None]:
+    """Find the CSV files in the data directory and its subdirectories.
+
+    Yields the path of each file relative to the data directory, and its
+    directory entry. The cache directories are skipped.
+
+    """
+    with os.scandir(data_dir) as entries:
+        for entry in entries:
+            path = prefix + entry.name
+            if entry.is_dir() and entry.name != CACHE_DIR:
+                yield from scan_csv_files(entry.path, path + os.sep)
+            elif entry.is_file() and entry.name.endswith(".csv"):
+                yield path, entry
+
+
+def match_key(path: str) -> Optional[str]:
+    """Return the game id for a file named `<team1>-<team2>-<game-id>.csv`.
+
+    The teams are sorted, and the game id (which may have dashes) is kept as
+    is. Files in subdirectories are prefixed by the directory. Returns None if
+    the name doesn't have the teams and the game id.
+
+    """
+    directory, name = os.path.split(splitext(path)[0])
+    parts = name.split("-", 2)
+    if len(parts) < 3:
+        return None
+    team_1, team_2, game = parts
+    key = "-".join(sorted([team_1, team_2]) + [game])
+    return join(directory, key) if directory else key
+
+
+def read_opponent(path: str) -> Optional[str]:
+    """Read the opponent from the first row of a game CSV file."""
+    try:
+        with open(path, newline="") as f:
+            return next(csv.DictReader(f))["Opponent"] or None
+    except (OSError, StopIteration, KeyError, csv.Error, UnicodeError):
+        return None
+
+
+def load_manifest(path: str) -> Dict[str, MatchFile]:
+    """Load the files of a saved manifest, keyed by their paths."""
+    try:
+        with open(path) as f:
+            manifest = json.load(f)
+        files = [f for m in manifest["matches"].values() for f in m["files"]]
+        files += manifest["orphans"]
+        files += [f for fs in manifest["conflicts"].values() for f in fs]
+        return {f["path"]: MatchFile(**f) for f in files}
+    except (OSError, ValueError, KeyError, TypeError):
+        return {}
+
+
+def save_manifest(path: str, manifest: Manifest) -> None:
+    """Save the manifest as JSON."""
+    matches = {}
+    for game_id, files in manifest.matches.items():
+        # The team of a file is the opponent named in the other file
+        teams = [f.opponent for f in reversed(files)]
+        matches[game_id] = {
+            "files": [f._asdict() for f in files],
+            "teams": teams,
+        }
+    state = {
+        "matches": matches,
+        "orphans": [f._asdict() for f in manifest.orphans],
+        "conflicts": {
+            key: [f._asdict() for f in files]
+            for key, files in manifest.conflicts.items()
+        },
+    }
+    try:
+        write_atomic(path, lambda f: json.dump(state, f, indent=2))
+    except OSError as e:
+        print("Could not save the manifest: {}".format(e), file=sys.stderr)
+
+
+def discover_matches(data_dir: str, use_cache: bool = True) -> Manifest:
+    """Find the pairs of CSV files of each match, in one pass over the files.
+
+    The files are found recursively, and paired by `match_key`. The opponent
+    named in each file is read when the file is first seen, and saved in a
+    manifest in the cache directory. Files that haven't changed since are only
+    stat-ed, and not opened again. The manifest is only rewritten when files
+    were added, changed or removed.
+
+    """
+    manifest_path = join(data_dir, CACHE_DIR, MANIFEST_FILE)
+    known = load_manifest(manifest_path) if use_cache else {}
+    files = defaultdict(list)  # type: Dict[str, List[MatchFile]]
+    orphans = []  # type: List[MatchFile]
+    changed = False
+    for path, entry in scan_csv_files(data_dir):
+        key = match_key(path)
+        stat = entry.stat()
+        f = known.pop(path, None)
+        if f is None or (f.size, f.mtime) != (stat.st_size, stat.st_mtime_ns):
+            opponent = read_opponent(entry.path) if key else None
+            f = MatchFile(path, stat.st_size, stat.st_mtime_ns, opponent)
+            changed = True
+        if key is None:
+            orphans.append(f)
+        else:
+            files[key].append(f)
+
+    matches = {}  # type: Dict[str, List[MatchFile]]
+    conflicts = {}  # type: Dict[str, List[MatchFile]]
+    for key, match in files.items():
+        opponents = {f.opponent for f in match}
+        if len(match) == 1:
+            orphans.extend(match)
+        elif len(match) > 2 or (None not in opponents and len(opponents) < 2):
+            conflicts[key] = match
+        else:
+            matches[key] = match
+
+    manifest = Manifest(matches, orphans, conflicts)
+    # Files left in `known` were removed, or are no longer in a match
+    if use_cache and (changed or known):
+        save_manifest(manifest_path, manifest)
+    return manifest
+
+
 # Data-helpers #########################################################
 
 
 def find_match_data(
-    data_dir: str
+    data_dir: str, report_skipped: bool = True, use_cache: bool = True
 ) -> Generator[Tuple[str, List[str]], None, None]:
     """Returns pairs of CSV file paths - one file per each team.
 
     This function assumes that the files are named in the format:
     `<team1>-<team2>-<game-id>.csv` and `<team2>-<team1>-<game-id>.csv`.
 
-    If a match has only one file, the match is skipped.
+    If a match has only one file, or conflicting files, the match is skipped.
+    See `discover_matches`.
 
     """
-    csv_files = glob.glob(join(data_dir, "*.csv"))
-    matches = defaultdict(list)  # type: Dict[str, List[str]]
-    for path in csv_files:
-        name = splitext(basename(path))[0]
-        key = "-".join(tuple(sorted(name.split("-"))))
-        matches[key].append(path)
-    for game_id, match in matches.items():
-        if len(match) < 2:
-            print("Skipping match: {}".format(match))
-            continue
-        yield game_id, match
+    manifest = discover_matches(data_dir, use_cache)
+    if report_skipped:
+        for f in manifest.orphans:
+            print(
+                "Skipping match: {}".format([join(data_dir, f.path)]),
+                file=sys.stderr,
+            )
+        for game_id, files in manifest.conflicts.items():
+            print(
+                "Skipping conflicting files for {}: {}".format(
+                    game_id, [join(data_dir, f.path) for f in files]
+                ),
+                file=sys.stderr,
+            )
+    for game_id, files in manifest.matches.items():
+        yield game_id, [join(data_dir, f.path) for f in files]
+
+
+@PROFILER.stage("segmentation")
+def segment_points(data: DF, engine: str = "pandas") -> Points:
+    """Segment the data of a team into points.
+
+    This is done once per team CSV, and all the scorers use the offsets
+    computed here. A "Point" column with the point number is added to the
+    data. Events recorded after the goal that ends a point (end of a quarter,
+    etc.) are not a part of any point, and their point number is -1.
+
+    """
+    check_players(data)
+    group = data.groupby(SCORE_COLUMNS, sort=True).ngroup().values
+    order = np.argsort(group, kind="stable")
+    data = data.iloc[order].reset_index(drop=True)
+    group = group[order]
+
+    goal = (data["Action"] == "Goal").values.astype(int)
+    boundaries = np.flatnonzero(np.r_[True, group[1:] != group[:-1]])
+    start = boundaries[group[boundaries] >= 0]
+    assert np.add.reduceat(goal, start).all(), "Point without a goal"
+
+    # Only the events up to the first goal in a group are a part of the point
+    goals_before = np.cumsum(goal) - goal
+    lengths = np.diff(np.r_[boundaries, len(data)])
+    goals_before -= np.repeat(goals_before[boundaries], lengths)
+    in_point = (group >= 0) & (goals_before == 0)
+    end = start + np.add.reduceat(in_point.astype(int), start)
+
+    data["Point"] = np.where(in_point, group, -1)
+    scores = [
+        (int(ours), int(theirs))
+        for ours, theirs in data[SCORE_COLUMNS].values[start]
+    ]
+    points = Points(data, scores, start, end, None, None)
+    points = points._replace(roster=point_roster(points))
+    if engine == "arrays":
+        points = points._replace(store=event_store(points))
+    return points
 
 
-def iter_points(data: DF) -> Generator[Tuple[Tuple[int, int], DF], None, None]:
+def iter_points(
+    points: Points
+) -> Generator[Tuple[Tuple[int, int], DF], None, None]:
     """Iterator over match score and points tuples"""
-    points = data.groupby(
-        ["Our Score - End of Point", "Their Score - End of Point"]
-    )
-    for score, point in points:
-        if point["Action"].iloc[-1] != "Goal":
-            idx = point[point["Action"] == "Goal"].index[0]
-            point = point.loc[:idx]
-        assert point["Action"].iloc[-1] == "Goal"
-        yield score, point
+    data = points.data
+    for score, start, end in zip(points.scores, points.start, points.end):
+        yield score, data.iloc[start:end]
 
 
-def player_gender(name: str) -> str:
-    assert name in ALL, "{} not listed".format(name)
-    return "F" if name in FEMALE else "M"
+def point_events(points: Points) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Index the events that are a part of a point.
 
+    Returns a mask selecting these events from the team data, the point number
+    of each of these events, and the offset of the first event of each point
+    among them.
+
+    """
+    point_ids = points.data["Point"].values
+    in_point = point_ids >= 0
+    lengths = points.end - points.start
+    offsets = np.cumsum(lengths) - lengths
+    return in_point, point_ids[in_point], offsets
 
-def point_gender_ratio(point: DF) -> Tuple[int, int]:
-    """Get gender ratio for a point.
 
-    NOTE: This is also computed per point, intentionally! We allow changing
-    gender ratios based on squad size.
+def count_unique_players(
+    point_ids: np.ndarray, names: np.ndarray, num_points: int
+) -> np.ndarray:
+    """Count the unique (named) players in each point."""
+    codes, uniques = pd.factorize(names)
+    valid = (codes >= 0) & (names != "Anonymous")
+    n = max(len(uniques), 1)
+    keys = np.unique(point_ids[valid] * n + codes[valid])
+    return np.bincount(keys // n, minlength=num_points)
+
+
+def starts_with(values: Series, prefixes: Tuple[str, ...]) -> np.ndarray:
+    """Check which values of a categorical start with any of the prefixes.
+
+    Only the categories are checked, and missing values are False.
+
+    """
+    categories = values.cat.categories
+    matches = np.r_[categories.str.startswith(prefixes), False]
+    return matches[values.cat.codes.values]
+
+
+def check_players(data: DF) -> None:
+    """Check that all the players in the data of a team are listed.
+
+    This is done once per team, when segmenting the data, so that the later
+    stages can look up genders without checking the names again. All the
+    players that are not listed are reported together.
 
     """
+    columns = ["Passer", "Receiver", "Defender"] + [
+        c for c in data.columns if c.startswith("Player ")
+    ]
+    names = set()  # type: Set[str]
+    for column in columns:
+        names.update(data[column].dropna().unique())
+    unknown = names - GENDERS.keys()
+    assert not unknown, "{} not listed".format(
+        ", ".join(sorted(map(str, unknown)))
+    )
 
-    players = point_players(point)
-    counts = Counter(map(player_gender, players))
-    ratio = [c for _, c in sorted(counts.items())]
-    return ratio[0], ratio[1]
 
+def player_genders(names: Series) -> Series:
+    """Look up the genders of many players at once.
 
-def point_num_players(point: DF) -> int:
-    """Get number of players playing in a point.
+    Returns a categorical series with "F" and "M" categories. The names are
+    not checked again, since `segment_points` checks all the players.
+
+    """
+    return names.map(GENDERS).astype(
+        pd.CategoricalDtype(categories=["F", "M"])
+    )
+
+
+def point_roster(points: Points) -> DF:
+    """Get the roster of each point of a team.
+
+    Returns a table with the number of players, the names of the players and
+    the gender ratio (F, M) for each point. This is computed once for a team,
+    and all the per-point helpers read from it.
 
     NOTE: This is computed per point, instead of per game, intentionally! We
-    allow the number of players to change during games, based on squad size.
+    allow the number of players and the gender ratios to change during games,
+    based on squad size.
 
     """
-    player_columns = [c for c in point.columns if c.startswith("Player ")]
-    players = sum(
-        [
-            1
-            for column in player_columns
-            if len(point[column].dropna()) == len(point)
-        ]
+    in_point, point_ids, offsets = point_events(points)
+    data = points.data
+    player_columns = [c for c in data.columns if c.startswith("Player ")]
+    on_field = data[player_columns].values
+    # Players who played the whole point
+    full = np.logical_and.reduceat(
+        pd.notna(on_field[in_point]), offsets, axis=0
     )
-    return players
+    num_players = full.sum(axis=1)
+    players = [
+        frozenset(first[:n])
+        for first, n in zip(on_field[points.start], num_players)
+    ]
+    names = Series([name for names in players for name in names])
+    point_numbers = np.repeat(np.arange(len(players)), list(map(len, players)))
+    is_female = (player_genders(names).cat.codes == 0).values
+    women = np.bincount(point_numbers[is_female], minlength=len(players))
+    roster = DF(
+        {
+            "Num Players": num_players,
+            "Players": players,
+            "F": women,
+            "M": num_players - women,
+        }
+    )
+    roster.index.name = "Point"
+    return roster
+
+
+def point_id(point: DF) -> int:
+    """Get the point number of a point."""
+    return point["Point"].iat[0]
+
 
+def point_gender_ratio(point: DF, roster: DF) -> Tuple[int, int]:
+    """Get gender ratio (F, M) for a point."""
+    f, m = roster.loc[point_id(point), ["F", "M"]]
+    return f, m
 
-def point_players(point: DF) -> Set[str]:
+
+def point_num_players(point: DF, roster: DF) -> int:
+    """Get number of players playing in a point."""
+    return roster.at[point_id(point), "Num Players"]
+
+
+def point_players(point: DF, roster: DF) -> Set[str]:
     """Return the names of players who played a point."""
-    n = point_num_players(point)
-    select_columns = point.columns.map(lambda x: x.startswith("Player "))
-    columns = point.loc[:, select_columns]
-    players = columns.iloc[0][:n]
-    return set(players)
+    return set(roster.at[point_id(point), "Players"])
+
+
+def parse_game_csv(url: str) -> DF:
+    """Parse a CSV file exported from Ulti-Analytics.
+
+    Only the columns in `GAME_SCHEMA` and the player columns are read.
+
+    """
+    data = pd.read_csv(
+        url,
+        usecols=lambda c: c in GAME_SCHEMA or c.startswith("Player "),
+        dtype=GAME_SCHEMA,
+    )
+    player_columns = [c for c in data.columns if c.startswith("Player ")]
+    return data.astype({c: "category" for c in player_columns})
+
+
+@PROFILER.stage("load")
+def load_game_csv(url: str, use_cache: bool = True) -> Tuple[DF, bool]:
+    """Load a game CSV file, from the cache if the file hasn't changed.
 
+    The parsed data is cached in a directory next to the CSV file, keyed by the
+    path, size and modification time of the file (and the schema and the
+    pandas version used to parse it). Only local files are cached, and a cache
+    file that can't be loaded is parsed again.
 
-def read_game_data(game_urls: List[str]) -> Dict[str, DF]:
-    """Read the CSV file pair for the match and a data dict."""
-    game_data = [pd.read_csv(url) for url in game_urls]
+    Returns the data, and whether it was loaded from the cache.
+
+    """
+    if not use_cache or not isfile(url):
+        return parse_game_csv(url), False
+
+    path = abspath(url)
+    stat = os.stat(path)
+    key = (
+        path,
+        stat.st_size,
+        stat.st_mtime_ns,
+        sorted(GAME_SCHEMA.items()),
+        pd.__version__,
+    )
+    cache_dir = join(dirname(path), CACHE_DIR)
+    cache_path = join(
+        cache_dir, "{}.pkl".format(hashlib.sha1(path.encode()).hexdigest())
+    )
+    # The key is pickled before the data, so that stale data (which may not
+    # even unpickle with this version of pandas) is never loaded
+    try:
+        with open(cache_path, "rb") as f:
+            if pickle.load(f) == key:
+                return pickle.load(f), True
+    except Exception:
+        pass
+
+    data = parse_game_csv(url)
+
+    def write(f: Any) -> None:
+        pickle.dump(key, f, protocol=pickle.HIGHEST_PROTOCOL)
+        pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    try:
+        write_atomic(cache_path, write, True)
+    except OSError as e:
+        print("Could not cache {}: {}".format(url, e), file=sys.stderr)
+    return data, False
+
+
+def read_game_data(
+    game_urls: List[str],
+    use_cache: bool = False,
+    load_stats: Optional[List[LoadStats]] = None,
+    engine: str = "pandas",
+) -> Dict[str, Points]:
+    """Read the CSV file pair for the match and a data dict.
+
+    If `load_stats` is given, the time taken to load each file and the memory
+    used by its data are appended to it.
+
+    """
+    game_data = []
+    for url in game_urls:
+        start = time.perf_counter()
+        data, cached = load_game_csv(url, use_cache)
+        if load_stats is not None:
+            seconds = time.perf_counter() - start
+            memory = int(data.memory_usage(deep=True).sum())
+            load_stats.append(LoadStats(url, cached, seconds, memory))
+        if data.empty:
+            raise ValueError("{} has no events".format(url))
+        game_data.append(data)
     data_1, data_2 = game_data
     name_1 = data_2["Opponent"].iloc[0]
     name_2 = data_1["Opponent"].iloc[0]
-    return {name_1: data_1, name_2: data_2}
+    return {
+        name_1: segment_points(data_1, engine),
+        name_2: segment_points(data_2, engine),
+    }
+
+
+def load_games(
+    matches: Iterable[Tuple[str, List[str]]], use_cache: bool = True
+) -> Generator[Tuple[str, Dict[str, Points]], None, None]:
+    """Read the data of each match, one at a time."""
+    for game_id, urls in matches:
+        yield game_id, read_game_data(urls, use_cache)
+
+
+def write_table(table: DF, path: str) -> None:
+    """Write a table as parquet if `path` ends with .parquet, or as CSV."""
+    if path.endswith(".parquet"):
+        table.to_parquet(path, index=False)
+    else:
+        table.to_csv(path, index=False)
+
+
+# Array engine #########################################################
+
+
+def event_store(points: Points) -> EventStore:
+    """Store the events of a team as arrays of integer codes.
+
+    The passer, receiver and defender columns share the same player codes.
+
+    """
+    data = points.data
+    roles = ["Passer", "Receiver", "Defender"]
+    players = pd.Index(
+        sorted(set().union(*(data[c].cat.categories for c in roles)))
+    )
+    player_codes = [
+        data[c].cat.set_categories(players).cat.codes.values.astype(np.int32)
+        for c in roles
+    ]
+    event_types = data["Event Type"].cat.categories
+    actions = data["Action"].cat.categories
+    return EventStore(
+        data["Event Type"].cat.codes.values.astype(np.int32),
+        data["Action"].cat.codes.values.astype(np.int32),
+        *player_codes,
+        data[SCORE_COLUMNS].values,
+        points.start,
+        points.end,
+        points.roster["Num Players"].values,
+        points.roster["F"].values,
+        event_types.values,
+        actions.values,
+        players.values,
+        players.get_loc("Anonymous") if "Anonymous" in players else -1,
+        event_types.get_loc("Offense") if "Offense" in event_types else -1,
+    )
+
+
+def points_store(points: Points) -> EventStore:
+    """Get the event store of a team, creating it if needed."""
+    return event_store(points) if points.store is None else points.store
+
+
+def store_point(store: EventStore, i: int) -> slice:
+    """Return the slice of the arrays with the events of the i-th point."""
+    return slice(store.start[i], store.end[i])
+
+
+def store_named(store: EventStore, codes: np.ndarray) -> np.ndarray:
+    """Return the unique player codes, without the missing and anonymous."""
+    codes = np.unique(codes)
+    return codes[(codes >= 0) & (codes != store.anonymous)]
+
+
+def store_offense(store: EventStore, i: int) -> np.ndarray:
+    """Return the positions of the offense events in the i-th point."""
+    event_type = store.event_type[store_point(store, i)]
+    return np.flatnonzero(event_type == store.offense)
+
+
+def store_is_all_touch(store: EventStore, i: int) -> bool:
+    """Is the i-th point an all-touch point? See `is_all_touch`."""
+    point = store_point(store, i)
+    touches = store_named(
+        store, np.r_[store.passer[point], store.receiver[point]]
+    )
+    return len(touches) == store.num_players[i]
+
+
+def store_has_no_turnovers(store: EventStore, i: int) -> bool:
+    """Does the team keep possession, once on offense? See `has_no_turnovers`.
+    """
+    offense = store_offense(store, i)
+    length = store.end[i] - store.start[i]
+    return bool(
+        len(offense)
+        and offense[-1] == length - 1
+        and offense[0] + len(offense) == offense[-1] + 1
+    )
+
+
+def store_is_perfect_score(store: EventStore, i: int) -> bool:
+    """Did all players touch the disc exactly once? See `is_perfect_score`."""
+    num_touches = store.num_players[i] - 1
+    start = store.start[i]
+    if num_touches:
+        start = max(start, store.end[i] - num_touches)
+    last = slice(start, store.end[i])
+    passers = store_named(store, store.passer[last])
+    receivers = store_named(store, store.receiver[last])
+    return bool(num_touches == len(passers) == len(receivers))
+
+
+def store_no_turn_score_pass_count(store: EventStore, i: int) -> int:
+    """Number of passes made before score, without a turnover.
+
+    See `no_turn_score_pass_count`.
+
+    """
+    if not store_has_no_turnovers(store, i):
+        return 0
+    return len(store_offense(store, i))
 
 
 # On-field scoring #####################################################
 
+# On-field score of a team in a game
+TeamScore = NamedTuple("TeamScore", [("goals", int), ("bonus", float)])
+
 
-def is_all_touch(point: DF) -> bool:
+def is_all_touch(point: DF, roster: DF) -> bool:
     """Is it an all-touch point?"""
 
-    n = point_num_players(point)
+    n = point_num_players(point, roster)
 
     # How is all-touch defined? Between turns? Or between scores? To keep it
     # simple, let's say between scores. The idea is to see if everyone on the
@@ -166,10 +1034,10 @@ def has_no_turnovers(point: DF) -> bool:
     )
 
 
-def is_perfect_score(point: DF) -> bool:
+def is_perfect_score(point: DF, roster: DF) -> bool:
     """Check if all players have touched the disc, and exactly once!"""
 
-    n = point_num_players(point)
+    n = point_num_players(point, roster)
     num_touches = n - 1
     events = point[-num_touches:]
     passers = set(events["Passer"].dropna()) - {"Anonymous"}
@@ -177,86 +1045,264 @@ def is_perfect_score(point: DF) -> bool:
     return num_touches == len(passers) == len(catchers)
 
 
-def on_field_score_team(
-    points: Generator[Tuple[Tuple[int, int], DF], None, None]
-) -> Tuple[int, float]:
-    """Compute on-field score of a team.
+def offense_runs(points: Points) -> Tuple[np.ndarray, np.ndarray]:
+    """Count the events on offense in each point of a team, and check if the
+    team kept possession once on offense (see `has_no_turnovers`)."""
+    in_point, point_ids, offsets = point_events(points)
+    num_points = len(offsets)
+    end = offsets + points.end - points.start
+
+    # No turnovers: the events on offense are at the end of the point, and
+    # without any breaks in between.
+    offense = points.data["Event Type"].values[in_point] == "Offense"
+    offense_count = np.bincount(point_ids[offense], minlength=num_points)
+    offense_total = np.r_[0, np.cumsum(offense)]
+    no_turnovers = (offense_count > 0) & (
+        offense_total[end] - offense_total[end - offense_count]
+        == offense_count
+    )
+    return offense_count, no_turnovers
+
+
+def bonuses_table(
+    scores: List[Tuple[int, int]],
+    n: np.ndarray,
+    all_touch: np.ndarray,
+    perfect: np.ndarray,
+    no_turnovers: np.ndarray,
+) -> DF:
+    """Tabulate the on-field bonus flags of each point (see
+    `on_field_bonuses`). A perfect score only counts for all-touch points."""
+    perfect = perfect & all_touch
+    bonuses = DF(
+        {
+            "Score": scores,
+            "Num Players": n,
+            "All Touch": all_touch,
+            "Perfect Score": perfect,
+            "No Turnovers": no_turnovers,
+            "Bonus": 0.5 * (1 * all_touch + perfect + no_turnovers),
+        }
+    )
+    bonuses.index.name = "Point"
+    return bonuses
+
+
+def store_on_field_bonuses(points: Points) -> DF:
+    """`on_field_bonuses` of the arrays engine, one point at a time."""
+    store = points_store(points)
+    flags = [
+        [f(store, i) for i in range(len(store.start))]
+        for f in (
+            store_is_all_touch, store_is_perfect_score, store_has_no_turnovers
+        )
+    ]
+    return bonuses_table(
+        points.scores,
+        store.num_players,
+        *(np.array(values, dtype=bool) for values in flags)
+    )
+
+
+def on_field_bonuses(points: Points, engine: str = "pandas") -> DF:
+    """Compute the on-field bonuses for all the points of a team, at once.
+
+    Returns a table with the number of players, the all-touch, perfect score
+    and no-turnovers flags, and the additional points for each point. The
+    flags are the same as computed by `is_all_touch`, `is_perfect_score` and
+    `has_no_turnovers` for a single point, except that a perfect score is only
+    counted for all-touch points.
 
-    Return (Goals, Additional Points)
     """
-    additional_points = 0.0
-    for score, point in points:
-        if is_all_touch(point):
-            additional_points += 0.5
+    if engine == "arrays":
+        return store_on_field_bonuses(points)
+
+    in_point, point_ids, offsets = point_events(points)
+    data = points.data
+    num_points = len(offsets)
+    lengths = points.end - points.start
+    end = offsets + lengths
+    position = np.arange(len(point_ids))
+    n = points.roster["Num Players"].values
+
+    # All-touch: unique passers and receivers in the point
+    passers = data["Passer"].values[in_point]
+    receivers = data["Receiver"].values[in_point]
+    touches = count_unique_players(
+        np.r_[point_ids, point_ids],
+        np.r_[passers, receivers],
+        num_points,
+    )
+    all_touch = touches == n
 
-            if is_perfect_score(point):
-                additional_points += 0.5
+    # Perfect score: n - 1 unique passers and receivers in the last n - 1
+    # events of the point (or the whole point, when there are no touches).
+    num_touches = n - 1
+    window = np.where(num_touches > 0, num_touches, lengths)
+    last = end[point_ids] - position <= window[point_ids]
+    perfect = (
+        (num_touches == count_unique_players(
+            point_ids[last], passers[last], num_points
+        ))
+        & (num_touches == count_unique_players(
+            point_ids[last], receivers[last], num_points
+        ))
+    )
 
-        if has_no_turnovers(point):
-            additional_points += 0.5
+    _, no_turnovers = offense_runs(points)
+    return bonuses_table(points.scores, n, all_touch, perfect, no_turnovers)
 
-    ours, theirs = score
-    return (ours, additional_points)
 
+@PROFILER.stage("on-field")
+def on_field_score_team(points: Points, engine: str = "pandas") -> TeamScore:
+    """Compute on-field score of a team.
 
-def on_field_score_game(game_data: Dict[str, DF]) -> None:
-    scores = {
-        name: on_field_score_team(iter_points(data))
-        for name, data in game_data.items()
+    Return (Goals, Additional Points)
+    """
+    bonuses = on_field_bonuses(points, engine)
+    additional_points = float(bonuses["Bonus"].sum())
+    ours, theirs = points.scores[-1]
+    return TeamScore(ours, additional_points)
+
+
+def on_field_score_game(
+    game_data: Dict[str, Points], engine: str = "pandas"
+) -> Dict[str, TeamScore]:
+    return {
+        name: on_field_score_team(points, engine)
+        for name, points in game_data.items()
     }
-    for name, score in scores.items():
-        print("{name}: {score[0]} + {score[1]}".format(name=name, score=score))
 
 
 # Off-field scoring ####################################################
 
+# Off-field scoring contributions of a team in a game. These are combined for
+# the whole tournament by `off_field_scoring`.
+OffField = NamedTuple(
+    "OffField",
+    [
+        ("passes_by_gender", TCounter[str]),
+        ("expected_passes", Dict[str, float]),
+        ("pullers", Set[str]),
+        ("longest_o_point", int),
+        ("d_pass_count", float),
+    ],
+)
+
 
+@PROFILER.stage("passes by gender")
 def passes_by_gender(data: DF) -> TCounter[str]:
     """Return count of passes by gender (M-M, M-F, F-M, F-F)."""
 
-    def f(row: Series) -> str:
-        passer, catcher = row
-        return "{}-{}".format(player_gender(passer), player_gender(catcher))
-
     offense = data[data["Event Type"] == "Offense"]
     # Included unsuccessful passes too, since we are looking for the intent to pass
     passes = offense[
         offense["Action"].str.startswith(("Catch", "Goal", "Drop"))
     ]
-    gender_passes = passes[["Passer", "Receiver"]].apply(f, axis=1)
-    return Counter(gender_passes)
+    passers = player_genders(passes["Passer"]).cat.codes.values
+    receivers = player_genders(passes["Receiver"]).cat.codes.values
+    counts = np.bincount(2 * passers + receivers, minlength=4)
+    return Counter(
+        {pair: int(n) for pair, n in zip(GENDER_PAIRS, counts) if n}
+    )
 
 
-def expected_passes_count(data: DF) -> Dict[str, float]:
-    """Return the count of expected passes by gender."""
+def expected_pair_fractions(f: np.ndarray, m: np.ndarray) -> np.ndarray:
+    """Fraction of passes expected between each gender pair.
 
-    gender_ratio_passes = defaultdict(
-        lambda: 0
-    )  # type: Dict[Tuple[int, int], float]
-    expected_passes = defaultdict(lambda: 0)  # type: Dict[str, float]
+    For each gender ratio (f, m), a pass is expected to be between any two of
+    the players on the field with equal probability. The columns are in the
+    order of `GENDER_PAIRS`.
 
-    for score, point in iter_points(data):
-        offense = point[point["Event Type"] == "Offense"]
-        passes = offense[
-            offense["Action"].str.startswith(("Catch", "Goal", "Drop"))
+    """
+    n = f + m
+    return np.column_stack(
+        [
+            (f / n) * ((f - 1) / (n - 1)),
+            (f / n) * (m / (n - 1)),
+            (m / n) * (f / (n - 1)),
+            (m / n) * ((m - 1) / (n - 1)),
         ]
-        g_ratio = point_gender_ratio(point)
-        gender_ratio_passes[g_ratio] += len(passes)
+    )
 
-    for (f, m), count in gender_ratio_passes.items():
-        n = m + f
-        m_m = (m / n) * ((m - 1) / (n - 1)) * count
-        m_f = (m / n) * (f / (n - 1)) * count
-        f_m = (f / n) * (m / (n - 1)) * count
-        f_f = (f / n) * ((f - 1) / (n - 1)) * count
-        expected_passes["M-M"] += m_m
-        expected_passes["M-F"] += m_f
-        expected_passes["F-M"] += f_m
-        expected_passes["F-F"] += f_f
 
-    return expected_passes
+@PROFILER.stage("expected passes")
+def pass_balance(points: Points) -> DF:
+    """Return the expected and actual passes by gender, for each point.
 
+    The passes (including unsuccessful ones) of each point are counted by the
+    gender pair, and the expected passes computed from the gender ratio of the
+    point. Returns a table with the gender ratio (F, M), the number of passes,
+    and the expected and actual passes by gender pair, indexed by the point.
 
+    """
+    in_point, point_ids, _ = point_events(points)
+    data = points.data[in_point]
+    is_pass = (data["Event Type"] == "Offense").values & starts_with(
+        data["Action"], ("Catch", "Goal", "Drop")
+    )
+    passes = data[is_pass]
+    passers = player_genders(passes["Passer"]).cat.codes.values
+    receivers = player_genders(passes["Receiver"]).cat.codes.values
+    num_points = len(points.start)
+    actual = np.bincount(
+        4 * point_ids[is_pass] + 2 * passers + receivers,
+        minlength=4 * num_points,
+    ).reshape(num_points, 4)
+
+    roster = points.roster
+    count = actual.sum(axis=1)
+    f, m = roster["F"].values, roster["M"].values
+    expected = expected_pair_fractions(f, m) * count[:, np.newaxis]
+    table = DF({"F": f, "M": m, "Passes": count}, index=roster.index)
+    for j, pair in enumerate(GENDER_PAIRS):
+        table["Expected {}".format(pair)] = expected[:, j]
+    for j, pair in enumerate(GENDER_PAIRS):
+        table["Actual {}".format(pair)] = actual[:, j]
+    return table
+
+
+def expected_passes_count(points: Points) -> Dict[str, float]:
+    """Return the count of expected passes by gender."""
+
+    balance = pass_balance(points)
+    # Passes are totalled by the gender ratio, before the expected passes for
+    # each ratio are added up
+    by_ratio = balance.groupby(["F", "M"], sort=False)["Passes"].sum()
+    f = by_ratio.index.get_level_values("F").values
+    m = by_ratio.index.get_level_values("M").values
+    expected = expected_pair_fractions(f, m) * by_ratio.values[:, np.newaxis]
+    return {
+        pair: float(sum(expected[:, j]))
+        for j, pair in enumerate(GENDER_PAIRS)
+        if len(expected)
+    }
+
+
+def game_pass_balance(
+    games: Iterable[Tuple[str, Dict[str, Points]]], per_point: bool = False
+) -> DF:
+    """Return the expected and actual passes by gender, for many games.
+
+    The table has a row for each team in each game, or for each point if
+    `per_point` is True. See `pass_balance`.
+
+    """
+    tables = [
+        pass_balance(points).reset_index().assign(Game=game_id, Team=team)
+        for game_id, game_data in games
+        for team, points in game_data.items()
+    ]
+    table = pd.concat(tables, ignore_index=True)
+    keys = ["Game", "Team"]
+    table = table[keys + [c for c in table.columns if c not in keys]]
+    if per_point:
+        return table
+    table = table.drop(columns=["Point", "F", "M"])
+    return table.groupby(keys, sort=False).sum().reset_index()
+
+
+@PROFILER.stage("pullers")
 def pullers(data: DF) -> Set[str]:
     # Pull or PullOb for out-of-bounds
     return set(data[data["Action"].str.startswith("Pull")]["Defender"])
@@ -278,74 +1324,95 @@ def no_turn_score_pass_count(point: DF) -> int:
     return count
 
 
-def longest_no_turn_score(data: DF) -> int:
-    return max(
-        no_turn_score_pass_count(point) for _, point in iter_points(data)
-    )
+@PROFILER.stage("longest O")
+def longest_no_turn_score(points: Points, engine: str = "pandas") -> int:
+    if engine == "arrays":
+        store = points_store(points)
+        return max(
+            store_no_turn_score_pass_count(store, i)
+            for i in range(len(store.start))
+        )
+    # `no_turn_score_pass_count` of all the points at once
+    offense_count, no_turnovers = offense_runs(points)
+    return int((offense_count * no_turnovers).max())
 
 
-def split_posession_change(point: DF) -> List[DF]:
-    """Split a point by posession change.
+def possessions(points: Points) -> DF:
+    """Split the points of a team by possession change.
 
-    Events which happened between two turnovers are grouped together.
+    Events which happened between two turnovers are grouped together. The
+    possessions of the whole game are numbered with a single cumulative sum
+    over the change events. Returns the number of events and the first action
+    of each possession, indexed by the point and the possession number in the
+    point.
 
     """
-    change_events = ("Throwaway", "D", "Drop", "Goal")
-    changes = point[point["Action"].str.startswith(change_events)]
-    start = [point.index[0]] + list(changes.index + 1)
-    end = changes.index
-    split_point = [point.loc[x:y] for x, y in zip(start, end)]
-    return split_point
+    in_point, point_ids, offsets = point_events(points)
+    actions = points.data["Action"][in_point]
+    change = actions.str.startswith(CHANGE_EVENTS).fillna(False).values
+    # Every point ends with a goal, so a possession starts after each change
+    start = np.r_[True, change[:-1].astype(bool)]
+    first = np.flatnonzero(start)
+    possession = np.cumsum(start) - 1
+    point_first_possession = possession[offsets]
+    number = np.arange(len(first)) - point_first_possession[point_ids[first]]
+    table = DF(
+        {
+            "Point": point_ids[first],
+            "Possession": number,
+            "Events": np.bincount(possession, minlength=len(first)),
+            "Action": actions.values[first],
+        }
+    )
+    return table.set_index(["Point", "Possession"])
 
 
-def d_pass_count(team_a: DF, team_b: DF) -> Tuple[int, int]:
-    """Return number of passes before which each team got a D.
+@PROFILER.stage("fastest D")
+def fastest_d(game_data: List[Tuple[str, Points]]) -> Dict[str, float]:
+    """Returns the fastest D for each team in a game.
 
-    Returns a tuple (count_a, count_b) where count_a is the number of passes
-    Team B had before Team A got a D.
+    The possessions of the two teams are aligned by the point and possession
+    number. When a possession of a team is just a D, the other team made one
+    pass less than the number of events in its aligned possession.
 
     """
-    count_a = count_b = pd.np.inf
 
-    split_point = zip(
-        split_posession_change(team_a), split_posession_change(team_b)
+    (name_a, points_a), (name_b, points_b) = game_data
+    pairs = possessions(points_a).join(
+        possessions(points_b), how="inner", lsuffix=" A", rsuffix=" B"
     )
-    for A, B in split_point:
-        if len(A) == 1 and A.Action.iloc[0] == "D":
-            count_a = min(count_a, len(B) - 1)
-
-        elif len(B) == 1 and B.Action.iloc[0] == "D":
-            count_b = min(count_b, len(A) - 1)
-
-        else:
-            continue
-
-    return count_a, count_b
-
-
-def fastest_d(game_data: List[Tuple[str, DF]]) -> Dict[str, int]:
-    """Returns the fastest D for each team in a game."""
-
-    names = [name for name, _ in game_data]
-    team_wise_points = [
-        [point for _, point in iter_points(team_data)]
-        for _, team_data in game_data
-    ]
-    points = zip(*team_wise_points)
+    d_a = (pairs["Events A"] == 1) & (pairs["Action A"] == "D")
+    d_b = ~d_a & (pairs["Events B"] == 1) & (pairs["Action B"] == "D")
+    passes_before_d = {
+        name_a: pairs["Events B"][d_a] - 1,
+        name_b: pairs["Events A"][d_b] - 1,
+    }
+    return {
+        name: int(counts.min()) if len(counts) else np.inf
+        for name, counts in passes_before_d.items()
+    }
 
-    passes_before_d = defaultdict(
-        lambda: pd.np.inf
-    )  # type: Dict[str, pd.np.float]
-    for point in points:
-        for name, count in zip(names, d_pass_count(*point)):
-            passes_before_d[name] = min(count, passes_before_d[name])
 
-    return passes_before_d
+def off_field_score_game(
+    game: List[Tuple[str, Points]], engine: str = "pandas"
+) -> Dict[str, OffField]:
+    """Compute the off-field scoring contributions of each team in a game."""
+    d_pass_counts = fastest_d(game)
+    return {
+        team: OffField(
+            passes_by_gender(points.data),
+            dict(expected_passes_count(points)),
+            pullers(points.data),
+            longest_no_turn_score(points, engine),
+            d_pass_counts[team],
+        )
+        for team, points in game
+    }
 
 
 def off_field_scoring(
-    tournament_data: Dict[str, List[Tuple[str, DF]]]
-) -> None:
+    games: Iterable[Dict[str, OffField]]
+) -> Dict[str, OffField]:
     """Compute the off-field scores for the whole tournament."""
 
     tournament_pullers = defaultdict(set)  # type: Dict[str, Set[str]]
@@ -357,77 +1424,836 @@ def off_field_scoring(
     )  # type: Dict[str, Dict[str, float]]
     tournament_longest_o_point = defaultdict(lambda: 0)  # type: Dict[str, int]
     tournament_d_pass_count = defaultdict(
-        lambda: pd.np.inf
-    )  # type: Dict[str, pd.np.float]
+        lambda: np.inf
+    )  # type: Dict[str, np.float]
 
-    for game_id, game in tournament_data.items():
-        for team, team_data in game:
+    for game in games:
+        for team, scores in game.items():
             # Passes by Gender
-            for player_genders, count in passes_by_gender(team_data).items():
+            for player_genders, count in scores.passes_by_gender.items():
                 tournament_passes_by_gender[team][player_genders] += count
 
             # Expected passes by Gender
-            for genders, e_count in expected_passes_count(team_data).items():
+            for genders, e_count in scores.expected_passes.items():
                 expected_passes_by_gender[team][genders] += e_count
 
             # Pullers
-            tournament_pullers[team].update(pullers(team_data))
+            tournament_pullers[team].update(scores.pullers)
 
             # Longest no turn scores
-            score = longest_no_turn_score(team_data)
             previous = tournament_longest_o_point[team]
-            tournament_longest_o_point[team] = max(score, previous)
+            tournament_longest_o_point[team] = max(
+                scores.longest_o_point, previous
+            )
 
-        for team, d_pass_count in fastest_d(game).items():
+            # Fastest D
             previous = tournament_d_pass_count[team]
-            tournament_d_pass_count[team] = min(previous, d_pass_count)
+            tournament_d_pass_count[team] = min(previous, scores.d_pass_count)
+
+    return {
+        team: OffField(
+            Counter(tournament_passes_by_gender[team]),
+            dict(expected_passes_by_gender[team]),
+            team_pullers,
+            tournament_longest_o_point[team],
+            tournament_d_pass_count[team],
+        )
+        for team, team_pullers in tournament_pullers.items()
+    }
+
 
+def print_off_field_scores(off_field: Dict[str, OffField]) -> None:
     # FIXME: How do we score?
     print(
         "Division of passes by gender for each team: "
         "(followed by expected distribution)"
     )
-    for team, pass_data in tournament_passes_by_gender.items():
+    for team, scores in off_field.items():
+        if not scores.passes_by_gender:
+            continue
         pprint(team)
-        pprint(dict(pass_data))
-        pprint(dict(expected_passes_by_gender[team]))
+        pprint(dict(scores.passes_by_gender))
+        pprint(scores.expected_passes)
 
     # FIXME: Take into account total number of pulls made by each team?
     print("Pullers by team:")
-    pprint(dict(tournament_pullers))
+    pprint({team: scores.pullers for team, scores in off_field.items()})
 
     print("Longest number of passes before a score:")
     pprint(
         sorted(
-            tournament_longest_o_point.items(),
+            (
+                (team, scores.longest_o_point)
+                for team, scores in off_field.items()
+            ),
             key=lambda x: x[1],
             reverse=True,
         )
     )
 
     print("Number of passes before the team got a D:")
-    pprint(dict(tournament_d_pass_count))
+    pprint({team: scores.d_pass_count for team, scores in off_field.items()})
+
+
+# Player statistics ####################################################
+
+# Stats counted for each player: the role of the player in an event, and the
+# actions counted for that role.
+PLAYER_ACTIONS = [
+    ("Passes", "Passer", ("Catch", "Goal", "Drop")),
+    ("Catches", "Receiver", ("Catch", "Goal")),
+    ("Goals", "Receiver", ("Goal",)),
+    ("Assists", "Passer", ("Goal",)),
+    ("Drops", "Receiver", ("Drop",)),
+    ("Throwaways", "Passer", ("Throwaway",)),
+    ("Ds", "Defender", ("D",)),
+    ("Pulls", "Defender", ("Pull",)),
+]
+PLAYER_STATS = (
+    [stat for stat, _, _ in PLAYER_ACTIONS]
+    + ["Points Played"]
+    + ["Passes {}".format(pair) for pair in GENDER_PAIRS]
+    + ["Catches {}".format(pair) for pair in GENDER_PAIRS]
+)
 
 
-# Main  ################################################################
+def game_events(
+    games: Iterable[Tuple[str, Dict[str, Points]]]
+) -> Tuple[DF, DF]:
+    """Collect the events and the players of the points of many games.
 
+    Returns a table with the events that are a part of a point, and a table
+    with a row for each player in each point, for all the teams in the games.
 
-def main(data_dir: str) -> None:
-    matches = find_match_data(data_dir)
-    tournament_data = defaultdict(
-        list
-    )  # type: Dict[str, List[Tuple[str, DF]]]
-    for game_id, urls in matches:
-        game_data = read_game_data(urls)
-        on_field_score_game(game_data)
+    """
+    events = []  # type: List[DF]
+    players = []  # type: List[DF]
+    for game_id, game_data in games:
+        for team, points in game_data.items():
+            in_point, point_ids, _ = point_events(points)
+            data = points.data[in_point]
+            events.append(
+                DF(
+                    {
+                        "Game": game_id,
+                        "Team": team,
+                        "Point": point_ids,
+                        "Action": data["Action"].values,
+                        "Passer": data["Passer"].values,
+                        "Receiver": data["Receiver"].values,
+                        "Defender": data["Defender"].values,
+                    }
+                )
+            )
+            names = points.roster["Players"].explode().dropna()
+            players.append(
+                DF(
+                    {
+                        "Game": game_id,
+                        "Team": team,
+                        "Point": names.index.values,
+                        "Player": names.values,
+                    }
+                )
+            )
+    return (
+        pd.concat(events, ignore_index=True),
+        pd.concat(players, ignore_index=True),
+    )
+
+
+@PROFILER.stage("player stats")
+def player_stats(events: DF, players: DF) -> DF:
+    """Compute the stats of each player, from the events of many games.
+
+    All the events are labelled with the stats they count towards, and
+    counted in a single group by. Passes and catches are also counted by the
+    gender pairing of the passer and the receiver. Returns a table with a row
+    per player per team.
+
+    """
+    actions = events["Action"].astype("category")
+    labelled = []  # type: List[DF]
+    for stat, role, prefixes in PLAYER_ACTIONS:
+        names = events[role]
+        mask = starts_with(actions, prefixes) & names.notna().values
+        labelled.append(
+            DF(
+                {
+                    "Team": events["Team"].values[mask],
+                    "Player": names.values[mask],
+                    "Stat": stat,
+                }
+            )
+        )
+
+    # Passes and catches by the genders of the passer and the receiver. Drops
+    # are passes, but not catches.
+    is_pass = (
+        starts_with(actions, ("Catch", "Goal", "Drop"))
+        & events["Passer"].notna().values
+        & events["Receiver"].notna().values
+    )
+    passes = events[is_pass]
+    passers = player_genders(passes["Passer"]).cat.codes.values
+    receivers = player_genders(passes["Receiver"]).cat.codes.values
+    pairs = np.array(GENDER_PAIRS, dtype=object)[2 * passers + receivers]
+    is_catch = ~starts_with(actions[is_pass], ("Drop",))
+    for stat, role, mask in (
+        ("Passes", "Passer", slice(None)),
+        ("Catches", "Receiver", is_catch),
+    ):
+        labelled.append(
+            DF(
+                {
+                    "Team": passes["Team"].values[mask],
+                    "Player": passes[role].values[mask],
+                    "Stat": stat + " " + pairs[mask],
+                }
+            )
+        )
+
+    labelled.append(
+        players[["Team", "Player"]].assign(Stat="Points Played")
+    )
+    counts = (
+        pd.concat(labelled, ignore_index=True)
+        .groupby(["Team", "Player", "Stat"])
+        .size()
+        .unstack("Stat", fill_value=0)
+        .reindex(columns=PLAYER_STATS, fill_value=0)
+    )
+    counts = counts.drop(index="Anonymous", level="Player", errors="ignore")
+    counts.insert(
+        0,
+        "Gender",
+        player_genders(counts.index.get_level_values("Player").to_series())
+        .astype(str)
+        .values,
+    )
+    counts.columns.name = None
+    return counts.reset_index()
+
+
+# Results ##############################################################
+
+# Results of a tournament: the on-field scores of the teams in each game
+# (keyed by the game id), and the off-field scores of each team.
+Results = NamedTuple(
+    "Results",
+    [
+        ("on_field", Dict[str, Dict[str, TeamScore]]),
+        ("off_field", Dict[str, OffField]),
+    ],
+)
+
+
+def tournament_results(
+    games: Iterable[Tuple[str, Dict[str, TeamScore], Dict[str, OffField]]]
+) -> Results:
+    """Combine the scores of each game into the results of the tournament."""
+    games = list(games)
+    on_field = {game_id: on_field for game_id, on_field, _ in games}
+    off_field = off_field_scoring(off_field for _, _, off_field in games)
+    return Results(on_field, off_field)
+
+
+def print_results(results: Results) -> None:
+    for scores in results.on_field.values():
+        for name, score in scores.items():
+            print("{}: {} + {}".format(name, *score))
         print("*" * 40)
-        for team, data in game_data.items():
-            tournament_data[game_id].append((team, data))
-    off_field_scoring(tournament_data)
+    print_off_field_scores(results.off_field)
+
+
+def results_to_dict(results: Results) -> Dict[str, Any]:
+    """Convert the results to a JSON serializable dict."""
+    return {
+        "on_field": {
+            game_id: {team: score._asdict() for team, score in scores.items()}
+            for game_id, scores in results.on_field.items()
+        },
+        "off_field": {
+            team: {
+                "passes_by_gender": dict(scores.passes_by_gender),
+                "expected_passes": scores.expected_passes,
+                "pullers": sorted(scores.pullers),
+                "longest_o_point": scores.longest_o_point,
+                # No D is stored as null, since JSON has no infinity
+                "d_pass_count": None
+                if np.isinf(scores.d_pass_count)
+                else scores.d_pass_count,
+            }
+            for team, scores in results.off_field.items()
+        },
+    }
+
+
+def results_from_dict(data: Dict[str, Any]) -> Results:
+    """Load the results from a dict created by `results_to_dict`."""
+    on_field = {
+        game_id: {team: TeamScore(**score) for team, score in scores.items()}
+        for game_id, scores in data["on_field"].items()
+    }
+    off_field = {
+        team: OffField(
+            Counter(scores["passes_by_gender"]),
+            scores["expected_passes"],
+            set(scores["pullers"]),
+            scores["longest_o_point"],
+            np.inf
+            if scores["d_pass_count"] is None
+            else scores["d_pass_count"],
+        )
+        for team, scores in data["off_field"].items()
+    }
+    return Results(on_field, off_field)
+
+
+def load_results(path: str) -> Results:
+    """Load the results saved as JSON, without recomputing anything."""
+    with open(path) as f:
+        return results_from_dict(json.load(f))
+
+
+def results_tables(results: Results) -> Tuple[DF, DF]:
+    """Return the on-field and off-field results as tables.
+
+    The on-field table has a row per team per game, and the off-field table a
+    row per team.
+
+    """
+    on_field = DF(
+        [
+            (game_id, team, score.goals, score.bonus)
+            for game_id, scores in results.on_field.items()
+            for team, score in scores.items()
+        ],
+        columns=["Game", "Team", "Goals", "Bonus"],
+    )
+    rows = []
+    for team, scores in results.off_field.items():
+        row = {"Team": team}  # type: Dict[str, Any]
+        for pair in GENDER_PAIRS:
+            row["Passes {}".format(pair)] = scores.passes_by_gender[pair]
+        expected = scores.expected_passes
+        for pair in GENDER_PAIRS:
+            row["Expected Passes {}".format(pair)] = expected.get(pair, 0.0)
+        row["Pullers"] = ", ".join(sorted(scores.pullers))
+        row["Num Pullers"] = len(scores.pullers)
+        row["Longest O Point"] = scores.longest_o_point
+        row["Passes Before D"] = scores.d_pass_count
+        rows.append(row)
+    off_field = DF(rows, columns=list(rows[0]) if rows else ["Team"])
+    return on_field, off_field
+
+
+def write_results(
+    results: Results, output_format: str, output: Optional[str] = None
+) -> None:
+    """Write the results as json, csv or parquet.
+
+    JSON is written to the `output` file (or stdout). CSV and parquet write an
+    on_field and an off_field table, to the `output` directory (or the current
+    directory).
+
+    """
+    if output_format == "json":
+        data = results_to_dict(results)
+        if output:
+            with open(output, "w") as f:
+                json.dump(data, f, indent=2)
+        else:
+            json.dump(data, sys.stdout, indent=2)
+        return
+
+    output = output or "."
+    os.makedirs(output, exist_ok=True)
+    for name, table in zip(("on_field", "off_field"), results_tables(results)):
+        path = join(output, "{}.{}".format(name, output_format))
+        if output_format == "csv":
+            table.to_csv(path, index=False)
+        else:
+            table.to_parquet(path, index=False)
+
+
+# Main  ################################################################
+
+
+# Scores of a match, the stats of loading its data, and the profile of the
+# scoring stages (if enabled)
+MatchScores = NamedTuple(
+    "MatchScores",
+    [
+        ("on_field", Dict[str, TeamScore]),
+        ("off_field", Dict[str, OffField]),
+        ("load_stats", List[LoadStats]),
+        ("profile", Optional[Dict[str, Any]]),
+    ],
+)
+
+
+def score_match(
+    game_urls: List[str],
+    use_cache: bool = False,
+    profile: bool = False,
+    use_cprofile: bool = False,
+    engine: str = "pandas",
+) -> MatchScores:
+    """Compute the on-field and off-field scores for a match.
+
+    Only the scores are returned, and not the game data, so that matches can
+    be cheaply scored in worker processes.
+
+    """
+    PROFILER.enabled = profile
+    PROFILER.use_cprofile = use_cprofile
+    load_stats = []  # type: List[LoadStats]
+    game_data = read_game_data(game_urls, use_cache, load_stats, engine)
+    on_field = on_field_score_game(game_data, engine)
+    off_field = off_field_score_game(list(game_data.items()), engine)
+    stage_profile = PROFILER.collect() if profile else None
+    return MatchScores(on_field, off_field, load_stats, stage_profile)
+
+
+def print_load_stats(scores: Iterable[MatchScores]) -> None:
+    """Report the time taken to load the data, and the memory used by it."""
+    load_stats = []  # type: List[LoadStats]
+    game_memory = []  # type: List[int]
+    for match in scores:
+        if match.load_stats:
+            load_stats.extend(match.load_stats)
+            game_memory.append(sum(s.memory for s in match.load_stats))
+
+    cold = [s.seconds for s in load_stats if not s.cached]
+    warm = [s.seconds for s in load_stats if s.cached]
+    print(
+        "Loaded {} files: {} parsed in {:.3f}s, "
+        "{} from cache in {:.3f}s".format(
+            len(load_stats), len(cold), sum(cold), len(warm), sum(warm)
+        ),
+        file=sys.stderr,
+    )
+    if game_memory:
+        print(
+            "Game data uses {:.1f} KB per game ({:.1f} KB max)".format(
+                np.mean(game_memory) / 1024, max(game_memory) / 1024
+            ),
+            file=sys.stderr,
+        )
+
+
+def match_signature(game_urls: List[str]) -> Optional[Tuple[Any, ...]]:
+    """Return the paths, sizes and modification times of a match's files.
+
+    Returns None if any of the files is not a local file.
+
+    """
+    if not all(isfile(url) for url in game_urls):
+        return None
+    stats = [(abspath(url), os.stat(url)) for url in sorted(game_urls)]
+    return tuple((path, st.st_size, st.st_mtime_ns) for path, st in stats)
+
+
+def scoring_version() -> str:
+    """Return a hash of the scoring code and the player list.
+
+    Saved scores are only reused if neither of these has changed.
+
+    """
+    sha = hashlib.sha1()
+    with open(__file__, "rb") as f:
+        sha.update(f.read())
+    sha.update(repr(sorted(GENDERS.items())).encode())
+    return sha.hexdigest()
+
+
+def load_saved_scores(path: str) -> Dict[str, Tuple[Any, MatchScores]]:
+    """Load the saved scores of matches, keyed by the game id.
+
+    Each match also has the signature of its files when it was scored. Scores
+    saved by another version of the script, or that can't be loaded, are
+    ignored.
+
+    """
+    try:
+        with open(path, "rb") as f:
+            if pickle.load(f) != scoring_version():
+                return {}
+            matches = pickle.load(f)
+    except Exception:
+        return {}
+    return {
+        game_id: (
+            signature,
+            MatchScores(
+                {team: TeamScore(*score) for team, score in on_field.items()},
+                {team: OffField(*off) for team, off in off_field.items()},
+                [],
+                None,
+            ),
+        )
+        for game_id, (signature, on_field, off_field) in matches.items()
+    }
+
+
+def save_scores(path: str, scores: Dict[str, Tuple[Any, MatchScores]]) -> None:
+    """Save the scores of matches, to be reused by later runs."""
+    matches = {
+        game_id: (
+            signature,
+            {team: tuple(score) for team, score in match.on_field.items()},
+            {team: tuple(off) for team, off in match.off_field.items()},
+        )
+        for game_id, (signature, match) in scores.items()
+        if signature is not None
+    }
+
+    # The version is pickled before the scores, as in `load_game_csv`
+    def write(f: Any) -> None:
+        pickle.dump(scoring_version(), f, protocol=pickle.HIGHEST_PROTOCOL)
+        pickle.dump(matches, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    try:
+        write_atomic(path, write, True)
+    except OSError as e:
+        print("Could not save the scores: {}".format(e), file=sys.stderr)
+
+
+def score_matches(
+    matches: List[Tuple[str, List[str]]],
+    saved: Dict[str, Tuple[Any, MatchScores]],
+    jobs: int = 1,
+    use_cache: bool = True,
+    profile: bool = False,
+    use_cprofile: bool = False,
+    engine: str = "pandas",
+) -> Dict[str, Tuple[Any, MatchScores]]:
+    """Score the matches, reusing the saved scores of unchanged matches.
+
+    Only the new or changed matches are scored, in worker processes if `jobs`
+    is not 1. Returns the scores in the order of the matches.
+
+    """
+    signatures = [match_signature(urls) for _, urls in matches]
+    reuse = [
+        signature is not None and saved.get(game_id, (None,))[0] == signature
+        for (game_id, _), signature in zip(matches, signatures)
+    ]
+    changed = [urls for (_, urls), r in zip(matches, reuse) if not r]
+    score = partial(
+        score_match,
+        use_cache=use_cache,
+        profile=profile,
+        use_cprofile=use_cprofile,
+        engine=engine,
+    )
+    if jobs == 1 or not changed:
+        new_scores = list(map(score, changed))
+    else:
+        with Pool(jobs or None) as pool:
+            new_scores = pool.map(score, changed)
+
+    print(
+        "Scored {} matches, reused the saved scores of {} matches".format(
+            len(changed), sum(reuse)
+        ),
+        file=sys.stderr,
+    )
+    new = iter(new_scores)
+    return {
+        game_id: (signature, saved[game_id][1] if r else next(new))
+        for (game_id, _), signature, r in zip(matches, signatures, reuse)
+    }
+
+
+def write_profile(
+    scores: Dict[str, Tuple[Any, MatchScores]],
+    report_path: Optional[str] = None,
+    cprofile_path: Optional[str] = None,
+) -> None:
+    """Write the profile of the scoring stages, for each match and in total.
+
+    The report is written as JSON. The cProfile stats of the stage that took
+    the most time are dumped to `cprofile_path`, if given.
+
+    """
+    matches = {
+        game_id: match.profile
+        for game_id, (_, match) in scores.items()
+        if match.profile is not None
+    }
+    stages = {}  # type: Dict[str, Dict[str, float]]
+    for profile in matches.values():
+        for name, stats in profile["stages"].items():
+            total = stages.setdefault(
+                name, {"seconds": 0.0, "calls": 0, "rows": 0}
+            )
+            for key, value in stats.items():
+                total[key] += value
+
+    hottest = max(stages, key=lambda name: stages[name]["seconds"], default="")
+    if report_path:
+        report = {
+            "stages": stages,
+            "hottest_stage": hottest,
+            "matches": {
+                game_id: profile["stages"]
+                for game_id, profile in matches.items()
+            },
+        }
+        with open(report_path, "w") as f:
+            json.dump(report, f, indent=2)
+
+    cprofiles = [
+        SavedProfile(profile["cprofile"][hottest])
+        for profile in matches.values()
+        if hottest in profile["cprofile"]
+    ]
+    if cprofile_path and cprofiles:
+        stats = pstats.Stats(cprofiles[0])
+        for cprofile in cprofiles[1:]:
+            stats.add(cprofile)
+        stats.dump_stats(cprofile_path)
+        print(
+            "Saved cProfile of the {} stage to {}".format(
+                hottest, cprofile_path
+            ),
+            file=sys.stderr,
+        )
+
+
+def report_results(
+    scores: Dict[str, Tuple[Any, MatchScores]],
+    output_format: str = "text",
+    output: Optional[str] = None,
+) -> None:
+    results = tournament_results(
+        (game_id, match.on_field, match.off_field)
+        for game_id, (_, match) in scores.items()
+    )
+    if output_format == "text":
+        print_results(results)
+    else:
+        write_results(results, output_format, output)
+
+
+def watch(
+    data_dir: str,
+    scores: Dict[str, Tuple[Any, MatchScores]],
+    interval: float = 0.25,
+    use_cache: bool = True,
+    output_format: str = "text",
+    output: Optional[str] = None,
+    engine: str = "pandas",
+) -> None:
+    """Rescore the matches whose files land or change in `data_dir`.
+
+    The directory is polled every `interval` seconds. A match is scored once
+    both its files exist, and haven't changed since the previous poll (so that
+    files still being written are not parsed). Only that match is scored, and
+    the results are updated from the scores of the other matches, kept in
+    memory. Runs till interrupted.
+
+    """
+    scores_path = join(data_dir, CACHE_DIR, SCORES_FILE)
+    # Signatures of matches seen on the previous poll, and of the matches
+    # that couldn't be scored
+    pending = {}  # type: Dict[str, Any]
+    failed = {}  # type: Dict[str, Any]
+    print("Watching {} for new matches".format(data_dir), file=sys.stderr)
+    while True:
+        time.sleep(interval)
+        matches = dict(
+            find_match_data(data_dir, False, use_cache=use_cache)
+        )
+        updated = [game_id for game_id in scores if game_id not in matches]
+        for game_id in updated:
+            del scores[game_id]
+
+        for game_id, urls in matches.items():
+            signature = match_signature(urls)
+            if (
+                signature is None
+                or scores.get(game_id, (None,))[0] == signature
+                or failed.get(game_id) == signature
+            ):
+                continue
+            if pending.get(game_id) != signature:
+                pending[game_id] = signature
+                continue
+
+            del pending[game_id]
+            start = time.perf_counter()
+            try:
+                match = score_match(urls, use_cache, engine=engine)
+            except Exception as e:
+                # Retried when its files change, instead of stopping the watch
+                failed[game_id] = signature
+                print(
+                    "Could not score {}: {}".format(game_id, e),
+                    file=sys.stderr,
+                )
+                continue
+            failed.pop(game_id, None)
+            scores[game_id] = (signature, match)
+            updated.append(game_id)
+            print(
+                "Scored {} in {:.3f}s".format(
+                    game_id, time.perf_counter() - start
+                ),
+                file=sys.stderr,
+            )
+
+        if updated:
+            print(
+                "Updated {} at {}".format(
+                    ", ".join(updated), time.strftime("%H:%M:%S")
+                ),
+                file=sys.stderr,
+            )
+            report_results(scores, output_format, output)
+            sys.stdout.flush()
+            if use_cache:
+                save_scores(scores_path, scores)
+
+
+def main(
+    data_dir: str,
+    jobs: int = 1,
+    use_cache: bool = True,
+    profile: Optional[str] = None,
+    cprofile: Optional[str] = None,
+    output_format: str = "text",
+    output: Optional[str] = None,
+    watch_interval: Optional[float] = None,
+    player_stats_path: Optional[str] = None,
+    engine: str = "pandas",
+    pass_balance_path: Optional[str] = None,
+    fetch: Optional[str] = None,
+) -> None:
+    if fetch:
+        with open(fetch) as f:
+            urls = [line.strip() for line in f if line.strip()]
+        start = time.perf_counter()
+        fetched = fetch_matches(urls, data_dir)
+        print_fetch_stats(fetched, time.perf_counter() - start)
+    matches = list(find_match_data(data_dir, use_cache=use_cache))
+    scores_path = join(data_dir, CACHE_DIR, SCORES_FILE)
+    profiling = bool(profile or cprofile)
+    # Profiles are only collected while parsing and scoring, so neither the
+    # saved scores nor the parsed data are reused when profiling
+    reuse = use_cache and not profiling
+    saved = load_saved_scores(scores_path) if reuse else {}
+    scores = score_matches(
+        matches, saved, jobs, reuse, profiling, bool(cprofile), engine
+    )
+    report_results(scores, output_format, output)
+    print_load_stats(match for _, match in scores.values())
+    if use_cache:
+        save_scores(scores_path, scores)
+    if profiling:
+        write_profile(scores, profile, cprofile)
+    if player_stats_path:
+        events, players = game_events(load_games(matches, use_cache))
+        write_table(player_stats(events, players), player_stats_path)
+    if pass_balance_path:
+        balance = game_pass_balance(load_games(matches, use_cache), True)
+        write_table(balance, pass_balance_path)
+    if watch_interval is not None:
+        try:
+            watch(
+                data_dir,
+                scores,
+                watch_interval,
+                use_cache,
+                output_format,
+                output,
+                engine,
+            )
+        except KeyboardInterrupt:
+            pass
 
 
 if __name__ == "__main__":
     parser = ArgumentParser(prog=__file__, usage=__doc__.splitlines()[0])
     parser.add_argument("data_dir", help="Directory with .csv data")
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of matches to score in parallel (0 uses all CPUs)",
+    )
+    parser.add_argument(
+        "--no-cache",
+        dest="use_cache",
+        action="store_false",
+        help="Parse and score all the files, without using the cache",
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="REPORT",
+        help="Write the time, calls and rows of each scoring stage as JSON",
+    )
+    parser.add_argument(
+        "--cprofile",
+        metavar="FILE",
+        help="Dump the cProfile stats of the slowest scoring stage",
+    )
+    parser.add_argument(
+        "--format",
+        choices=["text", "json", "csv", "parquet"],
+        default="text",
+        help="Format of the results",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        help="File (json) or directory (csv, parquet) to write the results to",
+    )
+    parser.add_argument(
+        "--watch",
+        metavar="SECONDS",
+        type=float,
+        nargs="?",
+        const=0.25,
+        help="Keep watching the directory, and rescore matches as they land",
+    )
+    parser.add_argument(
+        "--player-stats",
+        metavar="FILE",
+        help="Write the stats of each player (as parquet for .parquet files)",
+    )
+    parser.add_argument(
+        "--pass-balance",
+        metavar="FILE",
+        help="Write the expected and actual passes by gender for each point",
+    )
+    parser.add_argument(
+        "--fetch",
+        metavar="URLS",
+        help="Fetch the files listed in URLS (one per line) into data_dir",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=ENGINES,
+        default="pandas",
+        help="Score the on-field bonuses and longest O of all points at "
+        "once, or of each point as views of NumPy arrays",
+    )
     args = parser.parse_args()
-    main(args.data_dir)
+    main(
+        args.data_dir,
+        args.jobs,
+        args.use_cache,
+        args.profile,
+        args.cprofile,
+        args.format,
+        args.output,
+        args.watch,
+        args.player_stats,
+        args.engine,
+        args.pass_balance,
+        args.fetch,
+    )
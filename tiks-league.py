@@ -6,10 +6,24 @@
 
 """
 
+from argparse import ArgumentParser
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 import csv
+import itertools
 import json
 import math
+import os
 from pprint import pprint
+import random
+import sys
+import time
+
+import numpy as np
+
+try:
+    from scipy.optimize import Bounds, LinearConstraint, milp
+except ImportError:  # scipy is optional, for the --exact solver
+    milp = None
 
 from baggage import BAGGAGE
 
@@ -46,36 +60,84 @@ NUMBER_FIELDS = {
     'availability'
 }
 
+# Metrics returned by evaluate_team
+METRICS = [
+    'n', 'availability', 'women', 'captains', 'skill', 'handling', 'defense',
+    'baggage'
+]
+
+# Weights of the spread (max - min) of each metric across teams, when
+# balancing teams. Split baggage is added up over all the teams instead.
+# Availability is balanced, but team sizes are also kept close.
+SPREAD_WEIGHTS = {
+    'n': 1,
+    'availability': 1,
+    'women': 1,
+    'captains': 1,
+    'skill': 1,
+    'handling': 1,
+    'defense': 1,
+}
+BAGGAGE_WEIGHT = 1
+
+# Columns of the player matrix of a Roster
+ATTRIBUTES = [
+    'availability', 'gender', 'captain', 'skill_score', 'throwing', 'catching',
+    'defense', 'handler-cutter', 'offense-defense'
+]
+
+
+class Player:
+    """A player, parsed once from a row of the data file.
+
+    Number fields are floats, captain is a bool, tournaments is the (1-based)
+    index in TOURNAMENTS_SCORE, and the skill score is precomputed. Players
+    are immutable, and shared by all the exporters and team generators.
+
+    """
+
+    FIELDS = [column.replace('-', '_') for column in COLUMNS]
+    __slots__ = FIELDS + ['experience_multiplier', 'skill_score']
+
+    def __init__(self, *values):
+        for field, value in zip(self.FIELDS, values):
+            object.__setattr__(self, field, value)
+        object.__setattr__(
+            self, 'experience_multiplier', experience_multiplier(self)
+        )
+        object.__setattr__(self, 'skill_score', player_skill(self))
+
+    @classmethod
+    def from_row(cls, row):
+        row = {key: value.strip() for key, value in row.items()}
+        for key in NUMBER_FIELDS:
+            row[key] = float(row[key])
+        row['height'] = float(row['height']) if row['height'] else None
+        row['captain'] = row['captain'] == 'Yes'
+        row['tournaments'] = TOURNAMENTS_SCORE.index(row['tournaments']) + 1
+        return cls(*(row[column] for column in COLUMNS))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Player is immutable')
+
+    def __reduce__(self):
+        return Player, tuple(getattr(self, field) for field in self.FIELDS)
 
-class Player(dict):
     def __repr__(self):
-        return self['name']
+        return self.name
 
 
 def get_players(data_file):
     with open(data_file) as f:
         players = [
-            Player(zip(COLUMNS, row))
+            dict(zip(COLUMNS, row))
             for row in csv.reader(f)
         ][1:]
     return players
 
 
-def normalize_player(player):
-    player = {
-        key: (value.strip() if isinstance(value, str) else value)
-        for key, value in player.items()
-    }
-    player['tournaments'] = TOURNAMENTS_SCORE.index(player['tournaments']) + 1
-    return Player(player)
-
-
-def munge_player_dangood(player):
-    player = normalize_player(player)
-    h = float(player['height'])
-    player['height'] = (math.floor(h/12), int(h - 12*math.floor(h/12)))
-    player['captain'] = ''  # if player['captain'] == 'No' else '*'
-    return player
+def read_players(data_file):
+    return [Player.from_row(row) for row in get_players(data_file)]
 
 
 def export_ultimate_hat(players):
@@ -101,33 +163,804 @@ def export_ultimate_hat(players):
 
     """
 
+    # Players without a height get the average height, so that they don't
+    # skew the height balance
+    heights = [p.height for p in players if p.height is not None]
+    average_height = sum(heights) / len(heights) if heights else 0
+
     print("skill_score")
-    for player in players:
-        p = munge_player_dangood(player)
-        p = munge_player(p)
-        p['skill_score'] = int(player_skill(p))
-        print("{captain}{name}:{gender}:{age}:{height[0]}'{height[1]}\":{skill_score}".format(**p))
+    for p in players:
+        if p.height is None:
+            print('No height for {}, using the average'.format(p.name),
+                  file=sys.stderr)
+        height = average_height if p.height is None else p.height
+        feet = math.floor(height/12)
+        inches = int(height - 12*feet)
+        captain = ''  # if not p.captain else '*'
+        print("{}{}:{}:{}:{}'{}\":{}".format(
+            captain, p.name, p.gender, int(p.age), feet, inches,
+            int(p.skill_score)
+        ))
+
 
+def create_teams(N, players, time_budget=0.5, seed=None, samples=0,
+                 steps=None):
+    """Create N balanced teams from the given players.
 
-def create_teams(N, players):
-    """Create N balanced teams from the given players. """
+    The players are dealt into teams, or the best of the given number of
+    random splits is picked, and the teams are then balanced. With a number
+    of steps, instead of a time budget, the teams depend only on the seed.
+
+    """
+
+    if not 1 <= N <= len(players):
+        raise ValueError(
+            "Can't split {} players into {} teams".format(len(players), N)
+        )
+    if samples:
+        teams = sample_teams(N, Roster(players), samples, seed)
+    else:
+        teams = deal_teams(N, players)
+    return optimize_teams(teams, time_budget, seed, steps=steps)
+
+
+def balance_run(N, players, seed, samples, steps):
+    """One seeded run of `create_teams`, in a worker process."""
+    teams = create_teams(N, players, seed=seed, samples=samples, steps=steps)
+    return teams_cost([evaluate_team(team) for team in teams]), seed, teams
+
+
+def multi_start(N, players, time_budget=10, top=5, seed=None, samples=0,
+                steps=20000, jobs=None):
+    """Balance the teams with many seeded runs, across a process pool.
+
+    Runs are started with the seeds seed, seed + 1, ... until the time budget
+    runs out (started runs are waited for). Returns the best `top` distinct
+    splits, as (cost, seed, teams) sorted by cost. A split can be reproduced
+    with `create_teams`, using its seed and the same samples and steps.
+
+    """
+    if seed is None:
+        seed = random.SystemRandom().getrandbits(32)
+    jobs = jobs or os.cpu_count() or 1
+    best = {}
+    start = time.monotonic()
+    with ProcessPoolExecutor(jobs) as executor:
+        running = set()
+        while True:
+            out_of_time = time.monotonic() - start >= time_budget
+            while not out_of_time and len(running) < jobs:
+                running.add(executor.submit(
+                    balance_run, N, players, seed, samples, steps
+                ))
+                seed += 1
+            if not running:
+                break
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                cost, run_seed, teams = future.result()
+                key = frozenset(
+                    frozenset(p.name for p in team) for team in teams
+                )
+                if key not in best or run_seed < best[key][1]:
+                    best[key] = (cost, run_seed, teams)
+
+    return sorted(best.values(), key=lambda x: (x[0], x[1]))[:top]
+
+
+def deal_teams(N, players):
+    """Deal the players into N teams, strongest first, women after men."""
 
     def sort_key(x):
-        return (x['availability'], x['tournaments'])
-    players = [munge_player(p) for p in players]
-    men = filter(lambda x: x['gender'] == 'M', players)
-    women = filter(lambda x: x['gender'] == 'F', players)
+        return (x.availability, x.tournaments)
+    men = filter(lambda x: x.gender == 'M', players)
+    women = filter(lambda x: x.gender == 'F', players)
     sorted_men = sorted(men, key=sort_key, reverse=True)
     sorted_women = sorted(women, key=sort_key, reverse=True)
     teams = [[] for _ in range(N)]
-    for i, player in enumerate(sorted_men):
-        teams[i % 4].append(player)
-    for i, player in enumerate(sorted_women, start=i+1):
-        teams[i % 4].append(player)
+    for i, player in enumerate(sorted_men + sorted_women):
+        teams[i % N].append(player)
 
     return teams
 
 
+def optimize_teams(teams, time_budget=0.5, seed=None, temperature=0.3,
+                   steps=None):
+    """Balance the teams by simulated annealing, within the time budget.
+
+    Each step moves a player to another team, or swaps two players between
+    teams. The metrics of the two changed teams are updated incrementally,
+    with `TeamsState`. Worse splits are accepted with a probability that drops
+    as the time (or the given number of steps) runs out. Returns the best
+    split found.
+
+    """
+    N = len(teams)
+    if N < 2 or (not steps and time_budget <= 0):
+        return teams
+    rng = random.Random(seed)
+    state = TeamsState(teams)
+    evaluations = state.evaluations()
+    cost = teams_cost(evaluations)
+    best_cost, best_teams = cost, state.teams()
+
+    start = time.monotonic()
+    step = 0
+    while True:
+        if step % 64 == 0:
+            if steps:
+                elapsed = step / steps
+            else:
+                elapsed = (time.monotonic() - start) / time_budget
+            if elapsed >= 1 or best_cost == 0:
+                break
+            t = temperature * (1 - elapsed)
+        step += 1
+
+        a, b = rng.sample(range(N), 2)
+        x = rng.choice(state.members[a]).name
+        old = evaluations[a], evaluations[b]
+        if rng.random() < 0.5 and len(state.members[a]) > 1:
+            evaluations[a], evaluations[b] = state.move(x, b)
+            undo = (state.move, x, a)
+        else:
+            y = rng.choice(state.members[b]).name
+            evaluations[a], evaluations[b] = state.swap(x, y)
+            undo = (state.swap, x, y)
+
+        new_cost = teams_cost(evaluations)
+        delta = new_cost - cost
+        if delta <= 0 or rng.random() < math.exp(-delta / t):
+            cost = new_cost
+            if cost < best_cost:
+                best_cost, best_teams = cost, state.teams()
+        else:
+            f, *args = undo
+            f(*args)
+            evaluations[a], evaluations[b] = old
+
+    return best_teams
+
+
+class TeamsState:
+    """Running totals of the `evaluate_team` metrics of each team.
+
+    Moving or swapping players only updates the totals of the two teams
+    involved, and the baggage pairs of the players moved, using an index of
+    the team of each player and of its slot in the team. Players are referred
+    to by their names.
+
+    """
+
+    def __init__(self, teams):
+        self.members = [list(team) for team in teams]
+        self.values = {}
+        self.team_of = {}
+        self.slot = {}
+        self.totals = [[0] * 7 for _ in self.members]
+        self.baggage = [0] * len(self.members)
+        self.pairs_of = {}
+        for i, pair in enumerate(BAGGAGE):
+            for name in pair:
+                self.pairs_of.setdefault(name, set()).add(i)
+        for t, team in enumerate(self.members):
+            for i, player in enumerate(team):
+                self.values[player.name] = player_values(player)
+                self.team_of[player.name] = t
+                self.slot[player.name] = i
+                self.add(t, player.name, 1)
+        self.count_pairs(range(len(BAGGAGE)), 1)
+
+    def add(self, t, name, sign):
+        totals = self.totals[t]
+        for i, value in enumerate(self.values[name]):
+            totals[i] += sign * value
+
+    def count_pairs(self, pairs, sign):
+        """Count the baggage pairs split by the current assignment."""
+        for i in pairs:
+            player, other = BAGGAGE[i]
+            teams = {self.team_of.get(player), self.team_of.get(other)}
+            if len(teams) == 2:
+                for t in teams - {None}:
+                    self.baggage[t] += sign
+
+    def evaluate(self, t):
+        """Return the same metrics as `evaluate_team`, for the t-th team."""
+        n, availability, women, captains, skill, handling, defense = (
+            self.totals[t]
+        )
+        return (
+            n, availability / 5, women, captains, skill / n, handling / n,
+            defense / n, self.baggage[t]
+        )
+
+    def evaluations(self):
+        return [self.evaluate(t) for t in range(len(self.members))]
+
+    def teams(self):
+        return [list(team) for team in self.members]
+
+    def move(self, name, b):
+        """Move a player to the b-th team.
+
+        Returns the metrics of the player's old team and of the new team.
+
+        """
+        a = self.team_of[name]
+        pairs = self.pairs_of.get(name, ())
+        self.count_pairs(pairs, -1)
+        # Swap-remove the player from the old team
+        team = self.members[a]
+        i = self.slot[name]
+        player, last = team[i], team[-1]
+        team[i] = last
+        self.slot[last.name] = i
+        team.pop()
+        self.slot[name] = len(self.members[b])
+        self.members[b].append(player)
+        self.add(a, name, -1)
+        self.add(b, name, 1)
+        self.team_of[name] = b
+        self.count_pairs(pairs, 1)
+        return self.evaluate(a), self.evaluate(b)
+
+    def swap(self, x, y):
+        """Swap two players between their teams.
+
+        Returns the metrics of the teams of x and y (before the swap).
+
+        """
+        a, b = self.team_of[x], self.team_of[y]
+        pairs = self.pairs_of.get(x, set()) | self.pairs_of.get(y, set())
+        self.count_pairs(pairs, -1)
+        team_a, team_b = self.members[a], self.members[b]
+        i, j = self.slot[x], self.slot[y]
+        team_a[i], team_b[j] = team_b[j], team_a[i]
+        self.slot[x], self.slot[y] = j, i
+        self.add(a, x, -1)
+        self.add(a, y, 1)
+        self.add(b, y, -1)
+        self.add(b, x, 1)
+        self.team_of[x], self.team_of[y] = b, a
+        self.count_pairs(pairs, 1)
+        return self.evaluate(a), self.evaluate(b)
+
+
+def check_teams_state(teams, steps=10000, seed=None):
+    """Check that `TeamsState` matches `evaluate_team`, over random steps."""
+    if len(teams) < 2:
+        return
+    rng = random.Random(seed)
+    state = TeamsState(teams)
+    for _ in range(steps):
+        a, b = rng.sample(range(len(teams)), 2)
+        if not state.members[a] or not state.members[b]:
+            continue
+        x = rng.choice(state.members[a]).name
+        if rng.random() < 0.5 and len(state.members[a]) > 1:
+            state.move(x, b)
+        else:
+            state.swap(x, rng.choice(state.members[b]).name)
+        for t in (a, b):
+            assert all(
+                state.slot[p.name] == i
+                for i, p in enumerate(state.members[t])
+            )
+            expected = evaluate_team(state.members[t])
+            actual = state.evaluate(t)
+            assert all(map(math.isclose, expected, actual)), (
+                expected, actual
+            )
+
+
+class Roster:
+    """The players as a player x attribute matrix (see ATTRIBUTES).
+
+    A split of the players into N teams is a vector of team labels (0 to N-1),
+    in the order of the players, and many splits are scored at once, as a
+    matrix of labels.
+
+    """
+
+    def __init__(self, players):
+        self.players = list(players)
+        self.names = [p.name for p in self.players]
+        self.matrix = np.array(
+            [
+                [player_attribute(p, a) for a in ATTRIBUTES]
+                for p in self.players
+            ],
+            dtype=float
+        ).reshape(-1, len(ATTRIBUTES))
+        self.values = self.player_values()
+        index = {name: i for i, name in enumerate(self.names)}
+        # Baggage pairs as positions of players, -1 if not in the roster
+        self.baggage = np.array(
+            [[index.get(name, -1) for name in pair] for pair in BAGGAGE],
+            dtype=int
+        ).reshape(-1, 2)
+
+    def column(self, attribute):
+        return self.matrix[:, ATTRIBUTES.index(attribute)]
+
+    def player_values(self):
+        """Vectorized `player_values`, for all the players."""
+        throwing, defense = self.column('throwing'), self.column('defense')
+        hc, od = self.column('handler-cutter'), self.column('offense-defense')
+        return np.column_stack([
+            np.ones(len(self.players)),
+            self.column('availability'),
+            self.column('gender'),
+            self.column('captain'),
+            self.column('skill_score'),
+            np.where(hc <= 3, throwing * (6 - hc)/2, throwing),
+            np.where(od >= 3, defense * od/2, defense),
+        ])
+
+    def teams(self, labels, N):
+        """Return the teams of a label vector."""
+        teams = [[] for _ in range(N)]
+        for player, t in zip(self.players, labels):
+            teams[t].append(player)
+        return teams
+
+    def evaluate(self, labels, N):
+        """Evaluate the teams of many splits, like `evaluate_team`.
+
+        `labels` is a (splits x players) matrix of labels, and the metrics are
+        returned as a (splits x N x METRICS) array. Empty teams have NaN
+        averages.
+
+        """
+        labels = np.atleast_2d(labels)
+        splits = len(labels)
+        # (splits x players x N) indicators of each player's team
+        onehot = labels[:, :, None] == np.arange(N)
+        totals = onehot.transpose(0, 2, 1).astype(float) @ self.values
+        n = totals[:, :, 0]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            averages = totals[:, :, 4:] / n[:, :, None]
+
+        # Pairs with a player out of the roster are always split
+        baggage = np.zeros((splits, N))
+        rows = np.arange(splits)
+        for i, j in self.baggage:
+            if i < 0 and j < 0:
+                continue
+            if i < 0 or j < 0:
+                np.add.at(baggage, (rows, labels[:, max(i, j)]), 1)
+                continue
+            split = labels[:, i] != labels[:, j]
+            np.add.at(baggage, (rows[split], labels[split, i]), 1)
+            np.add.at(baggage, (rows[split], labels[split, j]), 1)
+
+        return np.concatenate([
+            totals[:, :, :1], totals[:, :, 1:2] / 5, totals[:, :, 2:4],
+            averages, baggage[:, :, None]
+        ], axis=2)
+
+    def cost(self, labels, N):
+        """Vectorized `teams_cost` of many splits. Empty teams cost inf."""
+        metrics = self.evaluate(labels, N)
+        weights = np.array([SPREAD_WEIGHTS.get(m, 0) for m in METRICS])
+        spreads = metrics.max(axis=1) - metrics.min(axis=1)
+        baggage = metrics[:, :, METRICS.index('baggage')].sum(axis=1)
+        cost = spreads @ weights + BAGGAGE_WEIGHT * baggage
+        cost[(metrics[:, :, 0] == 0).any(axis=1)] = np.inf
+        return cost
+
+
+def sample_teams(N, roster, samples=10000, seed=None, batch=1000):
+    """Return the best of random splits of the roster into N teams.
+
+    The splits have team sizes that differ by at most one, and are scored in
+    batches.
+
+    """
+    rng = np.random.default_rng(seed)
+    base = np.arange(len(roster.players)) % N
+    best_cost, best = np.inf, base
+    for start in range(0, samples, batch):
+        size = min(batch, samples - start)
+        labels = rng.permuted(np.tile(base, (size, 1)), axis=1)
+        cost = roster.cost(labels, N)
+        i = cost.argmin()
+        if cost[i] < best_cost:
+            best_cost, best = cost[i], labels[i]
+    return roster.teams(best, N)
+
+
+def check_roster(roster, N, samples=1000, seed=None):
+    """Check that `Roster.evaluate` matches `evaluate_team`."""
+    rng = np.random.default_rng(seed)
+    labels = rng.integers(N, size=(samples, len(roster.players)))
+    metrics = roster.evaluate(labels, N)
+    costs = roster.cost(labels, N)
+    for split, evaluations, cost in zip(labels, metrics, costs):
+        teams = roster.teams(split, N)
+        if not all(teams):
+            assert cost == np.inf, cost
+            continue
+        expected = [evaluate_team(team) for team in teams]
+        assert np.allclose(expected, evaluations), (expected, evaluations)
+        assert math.isclose(teams_cost(expected), cost), (expected, cost)
+
+
+def metric_spreads(evaluations):
+    """Return the spread (max - min) of each metric across the teams."""
+    return {
+        metric: max(values) - min(values)
+        for metric, values in zip(METRICS, zip(*evaluations))
+    }
+
+
+def teams_cost(evaluations):
+    """Weighted spread of the team metrics, and the total split baggage."""
+    spreads = metric_spreads(evaluations)
+    baggage = sum(e[METRICS.index('baggage')] for e in evaluations)
+    return BAGGAGE_WEIGHT * baggage + sum(
+        weight * spreads[metric] for metric, weight in SPREAD_WEIGHTS.items()
+    )
+
+
+def balanced_limits(total, N):
+    """The most any team can have of a total split evenly into N teams, and
+    how many teams can have that many (the rest have one less)."""
+    low, extra = divmod(total, N)
+    return (low + 1, extra) if extra else (low, N)
+
+
+def baggage_units(players):
+    """Group the players into units that are kept together, by baggage."""
+    index = {p.name: i for i, p in enumerate(players)}
+    parent = list(range(len(players)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for player, other in BAGGAGE:
+        if player in index and other in index:
+            parent[find(index[player])] = find(index[other])
+    units = {}
+    for i in range(len(players)):
+        units.setdefault(find(i), []).append(i)
+    return list(units.values())
+
+
+def split_limits(N, players):
+    """Limits on the number of players, women and captains of each team."""
+    return [
+        balanced_limits(len(players), N),
+        balanced_limits(sum(p.gender == 'F' for p in players), N),
+        balanced_limits(sum(p.captain for p in players), N),
+    ]
+
+
+def satisfies_constraints(teams):
+    """Whether a split satisfies the constraints of `solve_teams`."""
+    players = [p for team in teams for p in team]
+    counts = [
+        [len(team), sum(p.gender == 'F' for p in team),
+         sum(p.captain for p in team)]
+        for team in teams
+    ]
+    for k, (most, teams_at_most) in enumerate(
+            split_limits(len(teams), players)):
+        values = [c[k] for c in counts]
+        if max(values) > most or values.count(most) > teams_at_most:
+            return False
+    team_of = {p.name: t for t, team in enumerate(teams) for p in team}
+    return all(
+        team_of[player] == team_of[other] for player, other in BAGGAGE
+        if player in team_of and other in team_of
+    )
+
+
+def solve_teams(N, players, time_limit=5, tolerance=0.05):
+    """Split the players into N teams with the least skill spread.
+
+    The constraints are that the number of players, women and captains are
+    balanced across teams (so, captains are on separate teams, if there are
+    at most N), and that baggage pairs are on the same team. The objective is
+    the spread of the average skill of the teams, as in `evaluate_team`.
+
+    The split is solved as an integer program with HiGHS, if scipy is
+    installed, and by `search_teams` otherwise.
+
+    Returns the best split found within the time limit, its skill spread, a
+    lower bound of the optimal skill spread, and whether the split is proven
+    to be within `tolerance` of the optimal skill spread.
+
+    League-sized rosters have splits with almost no skill spread, so neither
+    solver can prove a lower bound much above 0 in seconds. A split is then
+    only proven to be within the tolerance when its own skill spread is, and
+    the solvers may not find one within the time limit for 40 or more
+    players.
+
+    """
+    if milp is None:
+        return search_teams(N, players, time_limit, tolerance)
+    return milp_teams(N, players, time_limit, tolerance)
+
+
+def milp_teams(N, players, time_limit=5, tolerance=0.05):
+    """Split the players into N teams with the least skill spread, as an
+    integer program solved by HiGHS.
+
+    Each baggage group is assigned to one team, and teams are interchangeable,
+    so the first teams are the ones with a player more. The highest and the
+    lowest average skill are variables bounding the average skill of each
+    team, and their difference is minimized. HiGHS has no absolute gap
+    tolerance, so it runs until the time limit unless it proves the split
+    optimal.
+
+    """
+    start = time.monotonic()
+    units = baggage_units(players)
+    (most_n, n_at_most), (most_w, w_at_most), (most_c, c_at_most) = (
+        split_limits(N, players)
+    )
+    sizes = [most_n if t < n_at_most else most_n - 1 for t in range(N)]
+    values = np.array([
+        [
+            len(unit),
+            sum(players[i].gender == 'F' for i in unit),
+            sum(players[i].captain for i in unit),
+            sum(players[i].skill_score for i in unit),
+        ]
+        for unit in units
+    ])
+
+    # Variables: whether unit u is in team t (at u * N + t), and the highest
+    # and lowest average skill
+    n = len(units) * N
+    rows, lows, highs = [], [], []
+
+    def team_row(t, column, extra=()):
+        row = np.zeros(n + 2)
+        row[t:n:N] = values[:, column]
+        for i, value in extra:
+            row[i] = value
+        return row
+
+    for u in range(len(units)):
+        row = np.zeros(n + 2)
+        row[u * N:(u + 1) * N] = 1
+        rows.append(row)
+        lows.append(1)
+        highs.append(1)
+    for t, size in enumerate(sizes):
+        rows.append(team_row(t, 0))
+        lows.append(size)
+        highs.append(size)
+        for column, most, teams_at_most in (
+                (1, most_w, w_at_most), (2, most_c, c_at_most)):
+            rows.append(team_row(t, column))
+            lows.append(most if teams_at_most == N else most - 1)
+            highs.append(most)
+        rows.append(team_row(t, 3, [(n, -size)]))
+        lows.append(-np.inf)
+        highs.append(0)
+        rows.append(team_row(t, 3, [(n + 1, -size)]))
+        lows.append(0)
+        highs.append(np.inf)
+
+    cost = np.zeros(n + 2)
+    cost[n], cost[n + 1] = 1, -1
+    result = milp(
+        cost,
+        integrality=np.r_[np.ones(n), 0, 0],
+        bounds=Bounds(
+            np.r_[np.zeros(n), -np.inf, -np.inf],
+            np.r_[np.ones(n), np.inf, np.inf],
+        ),
+        constraints=LinearConstraint(np.array(rows), lows, highs),
+        options={'time_limit': time_limit},
+    )
+    if result.status == 2:
+        raise ValueError('No split satisfies the constraints')
+    if result.x is None:
+        raise RuntimeError('No split found within the time limit')
+
+    assignment = result.x[:n].reshape(len(units), N)
+    teams = [[] for _ in range(N)]
+    for unit, t in zip(units, assignment.argmax(axis=1)):
+        teams[t].extend(players[i] for i in unit)
+    averages = [sum(p.skill_score for p in team) / len(team) for team in teams]
+    spread = max(averages) - min(averages)
+    lower_bound = max(0, result.mip_dual_bound)
+    return {
+        'teams': teams,
+        'skill_spread': spread,
+        'lower_bound': lower_bound,
+        'within_tolerance': (
+            result.status == 0 or spread - lower_bound <= tolerance
+        ),
+        'solver': 'HiGHS',
+        'nodes': result.mip_node_count,
+        'seconds': time.monotonic() - start,
+    }
+
+
+def search_teams(N, players, time_limit=5, tolerance=0.05):
+    """Split the players into N teams with the least skill spread, by branch
+    and bound.
+
+    Baggage groups are assigned to teams one at a time: captains, groups and
+    women first, then the most skilled. Teams with the same counts and skill
+    are interchangeable, so only the first of them is tried. A partial split
+    is pruned when the skill spread it can end up with is not `tolerance`
+    less than the best split so far, and each new best split is improved by
+    swapping groups of the same counts between teams.
+
+    The search finishes, proving that the best split is within `tolerance`,
+    when every partial split left is pruned.
+
+    """
+    limits = split_limits(N, players)
+    units = sorted(
+        (
+            (
+                len(unit),
+                sum(players[i].gender == 'F' for i in unit),
+                sum(players[i].captain for i in unit),
+                sum(players[i].skill_score for i in unit),
+                unit,
+            )
+            for unit in baggage_units(players)
+        ),
+        key=lambda unit: (unit[2], unit[0], unit[1], unit[3]),
+        reverse=True,
+    )
+    (most_n, n_at_most), (most_w, w_at_most) = limits[:2]
+    least_n = most_n if n_at_most == N else most_n - 1
+    least_w = most_w if w_at_most == N else most_w - 1
+    sizes = {least_n, most_n}
+
+    # Sums of the smallest and largest m skills of the unassigned players,
+    # after each number of assigned units
+    smallest, largest = [], []
+    for depth in range(len(units) + 1):
+        skills = sorted(
+            players[i].skill_score for unit in units[depth:]
+            for i in unit[4]
+        )
+        smallest.append([0] + list(np.cumsum(skills)))
+        largest.append([0] + list(np.cumsum(skills[::-1])))
+
+    # The average skill of the teams, weighted by their size, is the average
+    # skill of all the players, so it is between the lowest and the highest
+    mean = sum(p.skill_score for p in players) / len(players)
+
+    def bound(depth, counts, skills):
+        """Lower bound of the skill spread of the splits of a node."""
+        highest_low, lowest_high = mean, mean
+        for (n, _, _), skill in zip(counts, skills):
+            low, high = math.inf, -math.inf
+            for size in sizes:
+                m = size - n
+                if m < 0 or m >= len(smallest[depth]):
+                    continue
+                low = min(low, (skill + smallest[depth][m]) / size)
+                high = max(high, (skill + largest[depth][m]) / size)
+            highest_low = max(highest_low, low)
+            lowest_high = min(lowest_high, high)
+        return max(0, highest_low - lowest_high)
+
+    def improve(labels, counts, skills):
+        """Swap units of the same counts between teams, while the skill
+        spread goes down."""
+        def spread():
+            averages = [s / c[0] for s, c in zip(skills, counts)]
+            return max(averages) - min(averages)
+
+        best = spread()
+        improved = True
+        while improved:
+            improved = False
+            for i, j in itertools.combinations(range(len(units)), 2):
+                a, b = labels[i], labels[j]
+                if a == b or units[i][:3] != units[j][:3]:
+                    continue
+                old = skills[a], skills[b]
+                delta = units[j][3] - units[i][3]
+                skills[a] += delta
+                skills[b] -= delta
+                new = spread()
+                if new < best - 1e-9:
+                    best, improved = new, True
+                    labels[i], labels[j] = b, a
+                else:
+                    skills[a], skills[b] = old
+        return tuple(labels), best
+
+    # Men left after each number of assigned units
+    men = [sum(u[0] - u[1] for u in units[depth:]) for depth in range(
+        len(units) + 1
+    )]
+
+    def fits(depth, counts):
+        for k, (most, teams_at_most) in enumerate(limits):
+            values = [c[k] for c in counts]
+            if max(values) > most or values.count(most) > teams_at_most:
+                return False
+        # The men left must fill the places left for men in the teams
+        needed = sum(max(0, least_n - n - (most_w - w)) for n, w, _ in counts)
+        room = sum(most_n - n - max(0, least_w - w) for n, w, _ in counts)
+        return needed <= men[depth] <= room
+
+    start = time.monotonic()
+    best, best_labels = math.inf, None
+    lower_bound = math.inf  # of the pruned nodes
+    root = (0, ((0, 0, 0),) * N, (0,) * N, ())
+    stack = [(bound(0, root[1], root[2]), root)]
+    nodes = 0
+    while stack:
+        nodes += 1
+        if nodes % 1024 == 0 and time.monotonic() - start > time_limit:
+            break
+        node_bound, (depth, counts, skills, labels) = stack.pop()
+        if node_bound >= best - tolerance:
+            lower_bound = min(lower_bound, node_bound)
+            continue
+        if depth == len(units):
+            spread = max(s / c[0] for c, s in zip(counts, skills)) - min(
+                s / c[0] for c, s in zip(counts, skills)
+            )
+            if spread < best:
+                labels, spread = improve(list(labels), counts, list(skills))
+                best, best_labels = spread, labels
+            continue
+
+        n, women, captains, skill, _ = units[depth]
+        children = []
+        seen = set()
+        for t in range(N):
+            if (counts[t], skills[t]) in seen:
+                continue
+            seen.add((counts[t], skills[t]))
+            c = counts[t]
+            child_counts = (
+                counts[:t] + ((c[0] + n, c[1] + women, c[2] + captains),) +
+                counts[t+1:]
+            )
+            if not fits(depth + 1, child_counts):
+                continue
+            child_skills = skills[:t] + (skills[t] + skill,) + skills[t+1:]
+            child_bound = bound(depth + 1, child_counts, child_skills)
+            if child_bound >= best - tolerance:
+                lower_bound = min(lower_bound, child_bound)
+                continue
+            children.append((
+                child_bound,
+                (depth + 1, child_counts, child_skills, labels + (t,))
+            ))
+        # Try the team with the least skill first
+        children.sort(key=lambda child: child[1][2][child[1][3][-1]])
+        stack.extend(reversed(children))
+
+    if best_labels is None:
+        if stack:
+            raise RuntimeError('No split found within the time limit')
+        raise ValueError('No split satisfies the constraints')
+    within_tolerance = not stack
+    lower_bound = min([best, lower_bound] + [b for b, _ in stack])
+    teams = [[] for _ in range(N)]
+    for unit, t in zip(units, best_labels):
+        teams[t].extend(players[i] for i in unit[4])
+    return {
+        'teams': teams,
+        'skill_spread': best,
+        'lower_bound': lower_bound,
+        'within_tolerance': within_tolerance,
+        'solver': 'branch and bound',
+        'nodes': nodes,
+        'seconds': time.monotonic() - start,
+    }
 
 
 def evaluate_team(team):
@@ -156,26 +989,17 @@ def evaluate_team(team):
     """
 
     n = len(team)
-    availability = sum(p['availability'] for p in team) / 5
-    women = sum(1 for p in team if p['gender'] == 'F')
-    captains = sum(1 for p in team if p['captain'] == 'Yes')
-    skill = sum(p['skill_score'] for p in team) / n
-    handling = sum(
-        p['throwing'] * (6 - p['handler-cutter'])/2 if p['handler-cutter'] <= 3
-        else p['throwing']
-        for p in team
-    ) / n
-    defense = sum(
-        p['defense'] * p['offense-defense']/2 if p['offense-defense'] >= 3
-        else p['defense']
-        for p in team
-    ) / n
+    availability = sum(p.availability for p in team) / 5
+    women = sum(1 for p in team if p.gender == 'F')
+    captains = sum(1 for p in team if p.captain)
+    skill = sum(p.skill_score for p in team) / n
+    handling = sum(player_handling(p) for p in team) / n
+    defense = sum(player_defense(p) for p in team) / n
     # How many players don't have their baggage player in the team?
+    names = {p.name for p in team}
     baggage = sum(
         1 for player, other in BAGGAGE
-        if
-        (player_in_team(player, team) and not player_in_team(other, team)) or
-        (player_in_team(other, team) and not player_in_team(player, team))
+        if (player in names) != (other in names)
     )
 
     return (
@@ -183,49 +1007,189 @@ def evaluate_team(team):
     )
 
 
-def player_in_team(player_name, team):
-    return player_name in {x['name'] for x in team}
+def player_handling(player):
+    if player.handler_cutter <= 3:
+        return player.throwing * (6 - player.handler_cutter)/2
+    return player.throwing
 
 
-def create_team_from_names(players, names):
-    return [p for p in players if p['name'] in names]
+def player_defense(player):
+    if player.offense_defense >= 3:
+        return player.defense * player.offense_defense/2
+    return player.defense
 
 
-def munge_player(player):
-    player = normalize_player(player)
-    player = {
-        key: (float(value) if key in NUMBER_FIELDS else value)
-        for key, value in player.items()
-    }
-    player['skill_score'] = player_skill(player)
-    return Player(player)
+def player_values(player):
+    """Values of a player that add up to the metrics of `evaluate_team`."""
+    return (
+        1,
+        player.availability,
+        1 if player.gender == 'F' else 0,
+        int(player.captain),
+        player.skill_score,
+        player_handling(player),
+        player_defense(player),
+    )
+
+
+def player_attribute(player, attribute):
+    """A (numeric) attribute of a player, for the Roster matrix."""
+    if attribute == 'gender':
+        return 1 if player.gender == 'F' else 0
+    if attribute == 'captain':
+        return int(player.captain)
+    return getattr(player, attribute.replace('-', '_'))
+
+
+def player_in_team(player_name, team):
+    return player_name in {x.name for x in team}
+
+
+def create_team_from_names(players, names):
+    return [p for p in players if p.name in names]
 
 
 def player_skill(player):
-    skill = player['throwing'] + player['catching'] + player['defense']
-    t = player['tournaments']
+    skill = player.throwing + player.catching + player.defense
+    t = player.tournaments
     experience = sum(3 - int(x/2) for x in range(2, t+1)) * 5
-    # availability = player['availability'] / 5
-    return (experience_multiplier(player) * skill + experience)
+    # availability = player.availability / 5
+    return (player.experience_multiplier * skill + experience)
 
 
 def experience_multiplier(player):
-    t = player['tournaments']
+    t = player.tournaments
     return math.sqrt(t) / math.sqrt(5)
 
 
-def main():
-    players = get_players('data/TIKS-league-masala-idli.csv')
-    teams = create_teams(4, players)
-    KEYS = ['age', 'comments', 'height', 'handler-cutter', 'offense-defense',
-            'timestamp', 'defense', 'catching', 'throwing', 'skill_score',
-            'tournaments', ]
-    for team in teams:
-        for player in team:
-            for key in KEYS:
-                player.pop(key)
+def export_teams(teams):
+    return [
+        [
+            {
+                'name': p.name,
+                'captain': 'Yes' if p.captain else 'No',
+                'gender': p.gender,
+                'availability': p.availability,
+            }
+            for p in team
+        ]
+        for team in teams
+    ]
 
-    print(json.dumps(teams))
+
+def main(data_file, N=4, time_budget=0.5, seed=None, check=False,
+         samples=0, steps=None, multi_start_budget=None, top=5, jobs=None,
+         exact_time_limit=None, tolerance=0.05):
+    players = read_players(data_file)
+    if not 1 <= N <= len(players):
+        sys.exit(
+            "Can't split {} players into {} teams".format(len(players), N)
+        )
+    if check:
+        check_teams_state(deal_teams(N, players), seed=seed)
+        check_roster(Roster(players), N, seed=seed)
+        print('TeamsState and Roster match evaluate_team')
+        return
+
+    if multi_start_budget:
+        steps = steps or 20000
+        results = multi_start(
+            N, players, multi_start_budget, top, seed, samples, steps, jobs
+        )
+        print(json.dumps([
+            {
+                'seed': run_seed,
+                'samples': samples,
+                'steps': steps,
+                'cost': cost,
+                'spreads': metric_spreads(
+                    [evaluate_team(team) for team in teams]
+                ),
+                'teams': export_teams(teams),
+            }
+            for cost, run_seed, teams in results
+        ]))
+        return
+
+    if exact_time_limit:
+        result = solve_teams(N, players, exact_time_limit, tolerance)
+        # How much more skill spread does the heuristic split have than the
+        # solver's split?
+        teams = create_teams(N, players, time_budget, seed, samples, steps)
+        skill = metric_spreads([evaluate_team(team) for team in teams])[
+            'skill'
+        ]
+        result['heuristic'] = {
+            'skill_spread': skill,
+            'excess_spread': skill - result['skill_spread'],
+            'satisfies_constraints': satisfies_constraints(teams),
+        }
+        result['spreads'] = metric_spreads(
+            [evaluate_team(team) for team in result['teams']]
+        )
+        result['teams'] = export_teams(result['teams'])
+        print(json.dumps(result))
+        return
+
+    teams = create_teams(N, players, time_budget, seed, samples, steps)
+    print(json.dumps(export_teams(teams)))
 
 if __name__ == '__main__':
-    main()
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument(
+        'data_file', nargs='?', default='data/TIKS-league-masala-idli.csv'
+    )
+    parser.add_argument('-N', '--teams', type=int, default=4)
+    parser.add_argument(
+        '--time-budget', type=float, default=0.5,
+        help='Seconds to spend balancing the teams'
+    )
+    parser.add_argument('--seed', type=int)
+    parser.add_argument(
+        '--check', action='store_true',
+        help='Check the incremental and batched team metrics against '
+        'evaluate_team'
+    )
+    parser.add_argument(
+        '--samples', type=int, default=0,
+        help='Start from the best of this many random splits, instead of '
+        'dealing the players'
+    )
+    parser.add_argument(
+        '--steps', type=int,
+        help='Annealing steps per run, instead of a time budget, so that the '
+        'teams depend only on the seed'
+    )
+    parser.add_argument(
+        '--multi-start', type=float, metavar='SECONDS',
+        help='Run many seeded runs in parallel for this many seconds, and '
+        'print the best distinct splits with their seeds'
+    )
+    parser.add_argument(
+        '--top', type=int, default=5,
+        help='Number of splits to print, with --multi-start'
+    )
+    parser.add_argument(
+        '-j', '--jobs', type=int,
+        help='Number of processes, with --multi-start'
+    )
+    parser.add_argument(
+        '--exact', type=float, metavar='SECONDS',
+        help='Split the teams with an exact solver (HiGHS, if scipy is '
+        'installed, or branch and bound), within this time limit, and '
+        'compare with the heuristic split. The lower bound of the skill '
+        'spread stays near 0 for league-sized rosters, so a split is only '
+        'proven within the tolerance (within_tolerance in the output) when '
+        'its skill spread is, which may not happen in time for 40 or more '
+        'players'
+    )
+    parser.add_argument(
+        '--tolerance', type=float, default=0.05,
+        help='Skill spread within which the exact solver stops improving'
+    )
+    args = parser.parse_args()
+    main(
+        args.data_file, args.teams, args.time_budget, args.seed, args.check,
+        args.samples, args.steps, args.multi_start, args.top, args.jobs,
+        args.exact, args.tolerance
+    )
@@ -0,0 +1,18 @@
+"""Import tiks-league-scoring.py, for the other tiks-league scripts.
+
+The script can't be imported by name, since its name has hyphens.
+
+"""
+
+import importlib.util
+from os.path import abspath, dirname, join
+from types import ModuleType
+
+
+def load_scoring() -> ModuleType:
+    """Import tiks-league-scoring.py, which can't be imported by name."""
+    path = join(dirname(abspath(__file__)), "tiks-league-scoring.py")
+    spec = importlib.util.spec_from_file_location("tiks_league_scoring", path)
+    scoring = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(scoring)
+    return scoring